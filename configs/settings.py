@@ -1,14 +1,37 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from typing import Optional
 
 class Settings(BaseSettings):
     OPENAI_API_KEY: str = Field(..., env="OPENAI_API_KEY")
     API_BASE: str = Field("https://api.openai.com/v1", env="API_BASE") 
     VISION_MODEL: str = Field("Qwen/Qwen2-VL-72B-Instruct", env="VISION_MODEL")
     TEXT_MODEL: str = Field("Qwen/Qwen2.5-72B-Instruct", env="TEXT_MODEL")
+    FALLBACK_API_BASE: Optional[str] = Field(None, env="FALLBACK_API_BASE")  # 默认与API_BASE相同
+    FALLBACK_API_KEY: Optional[str] = Field(None, env="FALLBACK_API_KEY")  # 默认与OPENAI_API_KEY相同
+    FALLBACK_VISION_MODEL: Optional[str] = Field(None, env="FALLBACK_VISION_MODEL")  # 设置后启用熔断切换
+    FALLBACK_TEXT_MODEL: Optional[str] = Field(None, env="FALLBACK_TEXT_MODEL")
+    BREAKER_FAILURE_THRESHOLD: int = Field(5, env="BREAKER_FAILURE_THRESHOLD")
+    BREAKER_LATENCY_THRESHOLD: float = Field(0, env="BREAKER_LATENCY_THRESHOLD")  # 秒，0表示不按耗时熔断
+    BREAKER_RESET_SECONDS: float = Field(30, env="BREAKER_RESET_SECONDS")
+    TRANSPORT_MODE: str = Field("live", env="TRANSPORT_MODE")  # live / record / replay
+    TRANSPORT_ARCHIVE: str = Field("llm_archive.sqlite", env="TRANSPORT_ARCHIVE")
     PROMPTS_DIR: str = "configs/prompts"
     MAX_WORKERS: int = Field(1, env="MAX_WORKERS")
     MAX_RETRIES: int = Field(3, env="MAX_RETRIES")
+    REQUEST_TIMEOUT: float = Field(120, env="REQUEST_TIMEOUT")  # 秒，单次HTTP请求的超时上限，取消的请求最迟在此时释放线程
+    MAX_CONTINUATIONS: int = Field(3, env="MAX_CONTINUATIONS")
+    REFINE_WORKERS: int = Field(2, env="REFINE_WORKERS")
+    TEXT_CONTEXT_TOKENS: int = Field(32768, env="TEXT_CONTEXT_TOKENS")
+    REFINE_MAX_TOKENS: int = Field(8192, env="REFINE_MAX_TOKENS")
+    ADAPTIVE_MIN_DPI: int = Field(72, env="ADAPTIVE_MIN_DPI")
+    ADAPTIVE_MAX_DPI: int = Field(300, env="ADAPTIVE_MAX_DPI")
+    MAX_PAGE_PIXELS: int = Field(16384 * 28 * 28, env="MAX_PAGE_PIXELS")  # Qwen2-VL默认max_pixels
+    FIGURE_DPI: int = Field(0, env="FIGURE_DPI")  # 0表示直接从发送给LLM的页面图像截取
+    STATS_PATH: str = Field(".doculingo_stats.json", env="STATS_PATH")  # 各doc_type历史输出token统计
+    QUEUE_LEASE_SECONDS: int = Field(120, env="QUEUE_LEASE_SECONDS")
+    QUEUE_MAX_ATTEMPTS: int = Field(3, env="QUEUE_MAX_ATTEMPTS")
+    MEMORY_BUDGET_MB: int = Field(0, env="MEMORY_BUDGET_MB")  # 0表示不限制，一次性处理全部页面
     
     class Config:
         env_file = ".env"
@@ -1,11 +1,19 @@
 import argparse
+import json
 import pathlib
+import fitz  # PyMuPDF
 
 from src.core.llm_integration import LLMProcessor
-from src.utils.pdf_processor import PDFProcessor
+from src.core.hybrid import HybridExtractor
+from src.core.planner import IngestPlanner
+from src.core.pipeline import StreamingPipeline
+from src.core.job_queue import SQLiteJobQueue
+from src.core.worker import QueueWorker
+from src.utils.pdf_processor import PDFProcessor, find_repeated_regions
 from src.utils.ppt_processor import convert_ppt_to_pdf
 from src.utils.html_extractor import combine_html_contents
-from src.utils.exporter import save_as_markdown
+from src.utils.exporter import save_as_markdown, save_as_jsonl
+from src.utils.profiler import profiler
 from configs.settings import settings
 import os
 
@@ -17,57 +25,69 @@ def parse_args():
                       help='Directory to save intermediate images')
     parser.add_argument('--dpi', type=int, default=150,
                       help='DPI for PDF to image conversion')
+    parser.add_argument('--adaptive_dpi', action='store_true',
+                      help='Choose DPI per page from font size and text density within --min_dpi/--max_dpi')
+    parser.add_argument('--min_dpi', type=int, default=settings.ADAPTIVE_MIN_DPI,
+                      help='Lower DPI bound for --adaptive_dpi')
+    parser.add_argument('--max_dpi', type=int, default=settings.ADAPTIVE_MAX_DPI,
+                      help='Upper DPI bound for --adaptive_dpi')
+    parser.add_argument('--figure_dpi', type=int, default=settings.FIGURE_DPI,
+                      help='Re-render figure regions from the PDF at this DPI (0: crop from the page image)')
+    parser.add_argument('--mask_repeated', action='store_true',
+                      help='Mask headers, footers and watermarks repeated across pages and emit them once as document metadata')
+    parser.add_argument('--hybrid', action='store_true',
+                      help='Take reliable text from the PDF text layer and send only tables, formulas and low-confidence regions to the model (qwen_vl_html only)')
     parser.add_argument('--max_tokens', type=int, default=4096,
                       help='Maximum tokens for LLM processing')
     parser.add_argument('--doc_type', type=str, default='qwen_vl_html',
                       help='Document type for processing')
     parser.add_argument('--convert_office', action='store_true',
                       help='Enable Office format conversion using LibreOffice')
+    parser.add_argument('--export_chunks', action='store_true',
+                      help='Export RAG chunks with page and bbox metadata as JSONL (qwen_vl_html only)')
+    parser.add_argument('--chunk_tokens', type=int, default=512,
+                      help='Target token length of each RAG chunk')
+    parser.add_argument('--refine', action='store_true',
+                      help='Refine extracted text with TEXT_MODEL, pipelined with extraction (markdown doc types; ignored for qwen_vl_html)')
+    parser.add_argument('--refine_doc_type', type=str, default=None,
+                      help='Document type whose refinement prompt is used (default: --doc_type)')
+    parser.add_argument('--schedule', type=str, default='cost', choices=['cost', 'file'],
+                      help='Page submission order: most expensive first (cost) or file order (file)')
+    parser.add_argument('--memory_budget_mb', type=int, default=settings.MEMORY_BUDGET_MB,
+                      help='Bound in-flight pages to this memory budget and stream finished pages to disk (0: disabled)')
+    parser.add_argument('--transport', type=str, default=settings.TRANSPORT_MODE, choices=['live', 'record', 'replay'],
+                      help='live: call the API; record: also archive raw responses; replay: serve archived responses offline')
+    parser.add_argument('--transport_archive', type=str, default=settings.TRANSPORT_ARCHIVE,
+                      help='Archive file used by --transport record/replay')
+    parser.add_argument('--plan', action='store_true',
+                      help='Dry run: estimate tokens, runtime and disk usage without calling the API and write a JSON plan (--pdf_path may be a directory)')
+    parser.add_argument('--profile', action='store_true',
+                      help='Write CPU (pstats), memory (tracemalloc) and timeline (trace.json) profiles to output_dir/profile')
+    parser.add_argument('--queue', type=str, default=None,
+                      help='SQLite job queue on a shared volume; without --worker, submit the document and assemble results')
+    parser.add_argument('--worker', action='store_true',
+                      help='Run as a queue worker that leases and processes tasks from --queue')
+    parser.add_argument('--exit_when_idle', action='store_true',
+                      help='Stop the worker when the queue has no tasks left')
     return parser.parse_args()
 
-def main():
-    args = parse_args()
-    
-    # 确保输出目录存在
-    os.makedirs(args.output_dir, exist_ok=True)
-    images_dir = os.path.join(args.output_dir, 'pdf_images')
-    os.makedirs(images_dir, exist_ok=True)
-    
-    # 检查文件类型，处理Office文档
-    input_file_path = args.pdf_path
-    file_extension = pathlib.Path(input_file_path).suffix.lower()
-    
-    # 如果是PPTX/PPT格式且启用了Office转换选项
-    if args.convert_office and file_extension in ['.pptx', '.ppt', '.doc', '.docx', '.xls', '.xlsx']:
-        from src.utils.ppt_processor import convert_ppt_to_pdf
-        pdf_output_path = os.path.join(args.output_dir, os.path.basename(input_file_path).replace(file_extension, '.pdf'))
-        input_file_path = convert_ppt_to_pdf(input_file_path, pdf_output_path)
-        print(f"已将 {file_extension} 文件转换为 PDF: {input_file_path}")
-    
-    processor = LLMProcessor(settings)
-    pdf_processor = PDFProcessor(dpi=args.dpi)
-
-    # PDF转图像
-    image_paths = pdf_processor.pdf_to_images(
-        pdf_path=input_file_path,
-        output_dir=images_dir
-    )
-
-    # 处理图像
-    page_contents = processor.process_images_batch(
-        image_paths=image_paths,
-        doc_type=args.doc_type,
-        max_tokens=args.max_tokens,
-    )
+def write_outputs(args, page_contents, input_file_path, input_filename, furniture=None):
+    """将按页序排列的处理结果写为HTML（含图像）或Markdown文件；furniture为跨页重复区域"""
     if args.doc_type=='qwen_vl_html':
         # 合并HTML内容
         output_images_dir = os.path.join(args.output_dir, 'output_images')
         os.makedirs(output_images_dir, exist_ok=True)
         
+        chunks = [] if args.export_chunks else None
         complete_html, all_image_info = combine_html_contents(
             page_contents,
             output_dir=output_images_dir,
-            embed_base64=False
+            embed_base64=False,
+            chunks=chunks,
+            chunk_tokens=args.chunk_tokens,
+            source_pdf=input_file_path,
+            figure_dpi=args.figure_dpi or None,
+            furniture=furniture
         )
 
         # # 保存HTML文件
@@ -75,12 +95,15 @@ def main():
         # with open(html_output_path, "w", encoding="utf-8") as f:
         #     f.write(complete_html)
         # 获取输入文件的基本名称（不含扩展名）并添加.html扩展名
-        input_filename = os.path.splitext(os.path.basename(args.pdf_path))[0]
         html_output_path = os.path.join(args.output_dir, f"{input_filename}.html")
         
         with open(html_output_path, "w", encoding="utf-8") as f:
             f.write(complete_html)
 
+        if chunks is not None:
+            chunks_output_path = os.path.join(args.output_dir, f"{input_filename}.chunks.jsonl")
+            save_as_jsonl(chunks, chunks_output_path)
+
         print("处理完成！")
         print("\n图像信息:")
         for bbox, path in all_image_info:
@@ -94,10 +117,181 @@ def main():
             content += str(result) + "\n\n---\n\n"
 
         # 保存结果
-        input_filename = os.path.splitext(os.path.basename(args.pdf_path))[0]
         md_output_path = os.path.join(args.output_dir, f"{input_filename}.md")
         save_as_markdown(content, md_output_path)
         print("处理完成！")
 
+def main():
+    args = parse_args()
+    if not args.profile:
+        run(args)
+        return
+
+    profiler.start(os.path.join(args.output_dir, 'profile'))
+    try:
+        run(args)
+    finally:
+        paths = profiler.stop()
+        print("性能分析结果:")
+        for kind, path in paths.items():
+            print(f"  {kind}: {path}")
+
+def run(args):
+    """按命令行参数执行转换（worker、队列协调、流式或批量模式）"""
+    settings.TRANSPORT_MODE = args.transport
+    settings.TRANSPORT_ARCHIVE = args.transport_archive
+    if args.worker:
+        # worker模式：从共享队列租用任务
+        if not args.queue:
+            raise ValueError("--worker 需要同时指定 --queue")
+        queue = SQLiteJobQueue(args.queue, settings.QUEUE_LEASE_SECONDS, settings.QUEUE_MAX_ATTEMPTS)
+        QueueWorker(queue, settings).run(exit_when_idle=args.exit_when_idle)
+        return
+    
+    # 确保输出目录存在
+    os.makedirs(args.output_dir, exist_ok=True)
+    images_dir = os.path.join(args.output_dir, 'pdf_images')
+    os.makedirs(images_dir, exist_ok=True)
+    
+    # 检查文件类型，处理Office文档
+    input_file_path = args.pdf_path
+    file_extension = pathlib.Path(input_file_path).suffix.lower()
+    
+    # 如果是PPTX/PPT格式且启用了Office转换选项
+    if args.convert_office and file_extension in ['.pptx', '.ppt', '.doc', '.docx', '.xls', '.xlsx']:
+        from src.utils.ppt_processor import convert_ppt_to_pdf
+        pdf_output_path = os.path.join(args.output_dir, os.path.basename(input_file_path).replace(file_extension, '.pdf'))
+        input_file_path = convert_ppt_to_pdf(input_file_path, pdf_output_path)
+        print(f"已将 {file_extension} 文件转换为 PDF: {input_file_path}")
+    
+    input_filename = os.path.splitext(os.path.basename(args.pdf_path))[0]
+
+    if args.plan:
+        # 预估模式：只用fitz读取文档，不调用API
+        if os.path.isdir(input_file_path):
+            pdf_paths = sorted(str(path) for path in pathlib.Path(input_file_path).glob('*.pdf'))
+        else:
+            pdf_paths = [input_file_path]
+        planner = IngestPlanner(
+            settings,
+            PDFProcessor(
+                dpi=args.dpi,
+                adaptive=args.adaptive_dpi,
+                min_dpi=args.min_dpi,
+                max_dpi=args.max_dpi,
+                max_pixels=settings.MAX_PAGE_PIXELS
+            ),
+            doc_type=args.doc_type,
+            max_tokens=args.max_tokens,
+            figure_dpi=args.figure_dpi or None
+        )
+        plan = planner.plan(pdf_paths)
+        plan_output_path = os.path.join(args.output_dir, f"{input_filename}.plan.json")
+        with open(plan_output_path, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+        print(json.dumps(plan["totals"], ensure_ascii=False, indent=2))
+        print(f"处理计划已保存: {plan_output_path}")
+        return
+
+    if args.queue:
+        # 协调者模式：提交文档，等待worker完成后组装结果
+        queue = SQLiteJobQueue(args.queue, settings.QUEUE_LEASE_SECONDS, settings.QUEUE_MAX_ATTEMPTS)
+        if args.hybrid:
+            print("队列模式暂不支持 --hybrid，按整页处理")
+        doc_id = queue.submit_document(
+            os.path.abspath(input_file_path),
+            os.path.abspath(args.output_dir),
+            {
+                "doc_type": args.doc_type,
+                "max_tokens": args.max_tokens,
+                "dpi": args.dpi,
+                "adaptive_dpi": args.adaptive_dpi,
+                "min_dpi": args.min_dpi,
+                "max_dpi": args.max_dpi,
+                "mask_repeated": args.mask_repeated,
+            }
+        )
+        print(f"已提交文档 {doc_id}，等待worker处理...")
+        page_contents = queue.wait_for_document(doc_id)
+        furniture = None
+        if args.mask_repeated:
+            # 重复区域检测只读取文本层，协调者自行计算即可
+            with fitz.open(input_file_path) as doc:
+                furniture = find_repeated_regions(doc)
+        write_outputs(args, page_contents, input_file_path, input_filename, furniture)
+        return
+
+    if args.refine and args.doc_type == 'qwen_vl_html':
+        # HTML页面带有data-bbox坐标和截图路径，整段改写会破坏结构
+        print("qwen_vl_html 文档类型暂不支持润色，已跳过 --refine")
+        args.refine = False
+
+    processor = LLMProcessor(settings)
+    pdf_processor = PDFProcessor(
+        dpi=args.dpi,
+        adaptive=args.adaptive_dpi,
+        min_dpi=args.min_dpi,
+        max_dpi=args.max_dpi,
+        max_pixels=settings.MAX_PAGE_PIXELS,
+        mask_repeated=args.mask_repeated
+    )
+
+    if args.hybrid:
+        # 混合模式：文本层直接抽取，只有表格、公式和不可靠区域发送给模型
+        if args.doc_type != 'qwen_vl_html':
+            raise ValueError("--hybrid 仅支持 qwen_vl_html 文档类型")
+        extractor = HybridExtractor(processor, pdf_processor)
+        page_contents = extractor.process_document(input_file_path, images_dir, max_tokens=args.max_tokens)
+        stats = extractor.stats
+        print(f"混合抽取：文本块 {stats['text_blocks']}，图像 {stats['figures']}，"
+              f"区域请求 {stats['vlm_regions']}，整页请求 {stats['full_pages']}，发送像素 {stats['vlm_pixels']}")
+        profiler.snapshot("llm")
+        write_outputs(args, page_contents, input_file_path, input_filename, pdf_processor.repeated_regions)
+        return
+
+    if args.memory_budget_mb > 0:
+        # 内存受限模式：逐页流式处理并落盘
+        is_html = args.doc_type == 'qwen_vl_html'
+        output_path = os.path.join(args.output_dir, f"{input_filename}.{'html' if is_html else 'md'}")
+        chunks_path = None
+        if is_html and args.export_chunks:
+            chunks_path = os.path.join(args.output_dir, f"{input_filename}.chunks.jsonl")
+        if args.refine:
+            print("内存受限模式暂不支持润色，已跳过 --refine")
+        pipeline = StreamingPipeline(processor, pdf_processor, args.memory_budget_mb,
+                                     figure_dpi=args.figure_dpi or None)
+        page_count = pipeline.run(
+            input_file_path,
+            images_dir,
+            output_path,
+            doc_type=args.doc_type,
+            max_tokens=args.max_tokens,
+            output_images_dir=os.path.join(args.output_dir, 'output_images'),
+            chunks_path=chunks_path,
+            chunk_tokens=args.chunk_tokens
+        )
+        print(f"处理完成！共 {page_count} 页，输出: {output_path}")
+        return
+
+    # PDF转图像
+    image_paths = pdf_processor.pdf_to_images(
+        pdf_path=input_file_path,
+        output_dir=images_dir
+    )
+    profiler.snapshot("render")
+
+    # 处理图像
+    page_contents = processor.process_images_batch(
+        image_paths=image_paths,
+        doc_type=args.doc_type,
+        max_tokens=args.max_tokens,
+        refine=args.refine,
+        refine_doc_type=args.refine_doc_type,
+        page_signals=pdf_processor.page_signals,
+        schedule=args.schedule,
+    )
+    profiler.snapshot("llm")
+    write_outputs(args, page_contents, input_file_path, input_filename, pdf_processor.repeated_regions)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
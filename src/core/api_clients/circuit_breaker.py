@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    CLOSED: 正常放行；连续失败（或超时的慢请求）达到阈值后转为OPEN。
+    OPEN: 拒绝请求，reset_seconds后转为HALF_OPEN。
+    HALF_OPEN: 只放行一个探测请求，成功则恢复CLOSED，失败则重新OPEN。
+    只有探测请求的结果会改变OPEN/HALF_OPEN状态，熔断前已发出、之后才返回的请求结果被忽略。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, latency_threshold=0, reset_seconds=30):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            latency_threshold: 超过该耗时（秒）的成功请求也计为失败，0表示不检查
+            reset_seconds: 熔断后多久开始探测恢复
+        """
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        # 发出探测请求的线程，用于识别探测请求的结果
+        self.probe_thread = None
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """当前请求是否可以发往主服务"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                self.probe_thread = threading.get_ident()
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        """记录一次成功请求及其耗时"""
+        if self.latency_threshold and latency > self.latency_threshold:
+            self.record_failure()
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                self.failures = 0
+            elif self._is_probe():
+                print("主服务已恢复，熔断器关闭")
+                self.failures = 0
+                self.state = self.CLOSED
+                self.probe_in_flight = False
+                self.probe_thread = None
+
+    def record_failure(self):
+        """记录一次失败请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                self.failures += 1
+                if self.failures < self.failure_threshold:
+                    return
+                print(f"主服务连续失败{self.failures}次，熔断器打开，切换到备用模型")
+            elif not self._is_probe():
+                return
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+            self.probe_thread = None
+
+    def record_inconclusive(self):
+        """请求结果无法说明主服务状态（如调用方设置的超时）：探测请求让出名额，状态不变"""
+        with self._lock:
+            if self._is_probe():
+                self.probe_in_flight = False
+                self.probe_thread = None
+
+    def _is_probe(self) -> bool:
+        """当前线程的请求是否为HALF_OPEN状态下的探测请求（调用方需持有锁）"""
+        return self.state == self.HALF_OPEN and self.probe_thread == threading.get_ident()
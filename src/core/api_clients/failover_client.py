@@ -0,0 +1,87 @@
+import time
+from types import SimpleNamespace
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, OpenAI
+
+from .circuit_breaker import CircuitBreaker
+
+
+def is_outage_error(error, params) -> bool:
+    """
+    判断请求错误是否说明主服务不可用
+
+    连接错误、服务端超时、5xx和429计为故障；调用方通过timeout参数设置的超时
+    （页面截止时间）以及4xx请求错误不计为故障。
+    """
+    if isinstance(error, APITimeoutError):
+        return params.get("timeout") is None
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class FailoverClient:
+    """
+    带熔断和备用模型的OpenAI兼容客户端
+
+    与OpenAI客户端一样通过 client.chat.completions.create(**params) 调用。
+    主服务熔断期间（或单次请求因服务故障失败时）请求发往备用端点，模型按
+    VISION_MODEL -> FALLBACK_VISION_MODEL、TEXT_MODEL -> FALLBACK_TEXT_MODEL 映射；
+    响应的model字段即实际提供服务的模型。
+    """
+
+    def __init__(self, settings, primary=None):
+        """
+        Args:
+            settings: 配置对象
+            primary: 主客户端，默认按API_BASE创建
+        """
+        self.settings = settings
+        self.primary = primary or OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.API_BASE,
+            timeout=settings.REQUEST_TIMEOUT,
+            max_retries=0
+        )
+        self.fallback = OpenAI(
+            api_key=settings.FALLBACK_API_KEY or settings.OPENAI_API_KEY,
+            base_url=settings.FALLBACK_API_BASE or settings.API_BASE,
+            timeout=settings.REQUEST_TIMEOUT,
+            max_retries=0
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.BREAKER_FAILURE_THRESHOLD,
+            latency_threshold=settings.BREAKER_LATENCY_THRESHOLD,
+            reset_seconds=settings.BREAKER_RESET_SECONDS
+        )
+        self.model_map = {
+            settings.VISION_MODEL: settings.FALLBACK_VISION_MODEL,
+            settings.TEXT_MODEL: settings.FALLBACK_TEXT_MODEL or settings.FALLBACK_VISION_MODEL,
+        }
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        """发送chat completion请求，主服务不可用时切换到备用模型"""
+        if self.breaker.allow_request():
+            start = time.monotonic()
+            try:
+                response = self.primary.chat.completions.create(**params)
+            except Exception as e:
+                if not is_outage_error(e, params):
+                    # 请求本身的错误或调用方超时，备用模型同样无法处理，直接抛出
+                    if isinstance(e, APIStatusError):
+                        self.breaker.record_success(time.monotonic() - start)
+                    else:
+                        self.breaker.record_inconclusive()
+                    raise
+                self.breaker.record_failure()
+                print(f"主服务请求失败，改用备用模型: {e}")
+            else:
+                self.breaker.record_success(time.monotonic() - start)
+                return response
+
+        fallback_params = dict(params)
+        fallback_params["model"] = self.model_map.get(params.get("model")) or params.get("model")
+        return self.fallback.chat.completions.create(**fallback_params)
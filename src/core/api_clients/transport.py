@@ -0,0 +1,93 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from types import SimpleNamespace
+
+from openai.types.chat import ChatCompletion
+
+# 不影响响应内容、不参与请求指纹的参数
+UNFINGERPRINTED_PARAMS = ("timeout",)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    model TEXT,
+    created REAL NOT NULL,
+    body BLOB NOT NULL
+);
+"""
+
+
+class ReplayMissError(LookupError):
+    """回放模式下归档中没有对应请求的响应"""
+
+
+def request_fingerprint(params: dict) -> str:
+    """对请求参数做规范化JSON序列化后计算sha256指纹"""
+    canonical = {k: v for k, v in params.items() if k not in UNFINGERPRINTED_PARAMS}
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RecordReplayClient:
+    """
+    记录/回放LLM原始响应的传输层
+
+    与OpenAI客户端一样通过 client.chat.completions.create(**params) 调用。
+    record模式下转发请求并将原始响应按请求指纹写入归档（SQLite + zlib压缩JSON）；
+    replay模式下完全不访问网络，按指纹确定性地返回归档中的响应，未命中时抛出ReplayMissError。
+    """
+
+    def __init__(self, client, archive_path, mode="record"):
+        """
+        Args:
+            client: 被包装的客户端（OpenAI或FailoverClient），replay模式下不会被调用
+            archive_path: 归档文件路径
+            mode: "record" 或 "replay"
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"不支持的传输模式: {mode}")
+        self.client = client
+        self.archive_path = archive_path
+        self.mode = mode
+        conn = sqlite3.connect(archive_path, timeout=60)
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        """按请求指纹记录或回放chat completion响应"""
+        fingerprint = request_fingerprint(params)
+        if self.mode == "replay":
+            return self._load(fingerprint)
+
+        response = self.client.chat.completions.create(**params)
+        self._store(fingerprint, response)
+        return response
+
+    def _load(self, fingerprint):
+        conn = sqlite3.connect(self.archive_path, timeout=60)
+        try:
+            row = conn.execute("SELECT body FROM responses WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise ReplayMissError(f"归档中没有请求 {fingerprint[:12]} 的响应")
+        return ChatCompletion.model_validate(json.loads(zlib.decompress(row[0])))
+
+    def _store(self, fingerprint, response):
+        data = response.model_dump(mode="json") if hasattr(response, "model_dump") else response
+        body = zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        conn = sqlite3.connect(self.archive_path, timeout=60)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (fingerprint, model, created, body) VALUES (?, ?, ?, ?)",
+                    (fingerprint, data.get("model"), time.time(), body)
+                )
+        finally:
+            conn.close()
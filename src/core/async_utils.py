@@ -0,0 +1,73 @@
+# async_utils.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """页面或文档超过截止时间，或调用方已取消"""
+
+
+class Deadline:
+    """
+    可在线程间共享的截止时间与取消标记
+
+    工作线程在发起请求、续写、重试前调用check()，并用remaining()作为HTTP请求超时，
+    这样调用方放弃后，已开始的请求最迟在截止时间到达时释放线程。
+    """
+
+    def __init__(self, expires: Optional[float] = None, parent: Optional["Deadline"] = None):
+        """
+        Args:
+            expires: time.monotonic()下的截止时刻，None表示不限
+            parent: 上级截止时间（如文档级），取两者中较早的一个，并继承其取消状态
+        """
+        self.expires = expires
+        self.parent = parent
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def after(cls, seconds: Optional[float], parent: Optional["Deadline"] = None) -> "Deadline":
+        """创建seconds秒后到期的截止时间"""
+        return cls(time.monotonic() + seconds if seconds else None, parent)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数，没有截止时间时返回None"""
+        candidates = []
+        if self.expires is not None:
+            candidates.append(self.expires - time.monotonic())
+        if self.parent is not None and self.parent.remaining() is not None:
+            candidates.append(self.parent.remaining())
+        return max(0.0, min(candidates)) if candidates else None
+
+    def check(self):
+        """已取消或已超时时抛出DeadlineExceeded"""
+        if self.cancelled:
+            raise DeadlineExceeded("请求已取消")
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded("超过截止时间")
+
+
+def run_sync(coro):
+    """
+    同步执行协程
+
+    当前线程没有运行中的事件循环时直接asyncio.run；在事件循环内部（异步服务、notebook）
+    调用时，在独立线程的新事件循环中执行，避免run_until_complete报错。
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
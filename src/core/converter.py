@@ -0,0 +1,106 @@
+# converter.py
+import asyncio
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from configs.settings import settings
+from src.core.async_utils import Deadline, DeadlineExceeded, run_sync
+from src.core.llm_integration import LLMProcessor
+from src.utils.html_extractor import combine_html_contents
+from src.utils.pdf_processor import PDFProcessor
+
+
+class ConversionResult(BaseModel):
+    content: str
+    pages: list
+    failed_pages: List[int]
+    image_paths: List[str]
+
+
+async def aconvert_document(
+    pdf_path: str,
+    output_dir: str,
+    doc_type: str = "qwen_vl_html",
+    max_tokens: int = 4096,
+    dpi: int = 150,
+    page_timeout: Optional[float] = None,
+    timeout: Optional[float] = None,
+    processor: Optional[LLMProcessor] = None,
+    pdf_processor: Optional[PDFProcessor] = None,
+) -> ConversionResult:
+    """
+    异步转换整个文档，可在运行中的事件循环（异步服务、notebook）中直接await
+
+    Args:
+        pdf_path: 输入PDF路径
+        output_dir: 中间图片和截取图像的保存目录
+        doc_type: 文档类型
+        max_tokens: 单页最大输出token数
+        dpi: 未传入pdf_processor时使用的渲染DPI
+        page_timeout: 单页超时（秒），超时页面被跳过并记录在failed_pages中
+        timeout: 整个文档的超时（秒）
+        processor: 复用的LLMProcessor，默认新建
+        pdf_processor: 复用的PDFProcessor，默认按dpi新建
+
+    Returns:
+        ConversionResult: content为完整HTML（qwen_vl_html）或Markdown
+
+    Raises:
+        DeadlineExceeded: 文档超过timeout时抛出，所有在途请求随之放弃
+        asyncio.CancelledError: 调用方取消时抛出，排队中的页面不再执行
+    """
+    processor = processor or LLMProcessor(settings)
+    pdf_processor = pdf_processor or PDFProcessor(dpi=dpi)
+    deadline = Deadline.after(timeout)
+    loop = asyncio.get_running_loop()
+    images_dir = os.path.join(output_dir, 'pdf_images')
+
+    try:
+        image_paths = await asyncio.wait_for(
+            loop.run_in_executor(None, pdf_processor.pdf_to_images, pdf_path, images_dir),
+            deadline.remaining()
+        )
+        pages = await asyncio.wait_for(
+            processor.async_process_images_concurrent(
+                image_paths,
+                doc_type=doc_type,
+                max_tokens=max_tokens,
+                page_signals=pdf_processor.page_signals,
+                page_timeout=page_timeout,
+                deadline=deadline,
+            ),
+            deadline.remaining()
+        )
+    except asyncio.TimeoutError:
+        deadline.cancel()
+        raise DeadlineExceeded(f"文档处理超过{timeout}秒")
+    except BaseException:
+        deadline.cancel()
+        raise
+
+    failed_pages = [index + 1 for index, page in enumerate(pages) if page is None]
+    finished = [page for page in pages if page is not None]
+
+    if doc_type == "qwen_vl_html":
+        output_images_dir = os.path.join(output_dir, 'output_images')
+        content, image_info = await loop.run_in_executor(
+            None, lambda: combine_html_contents(finished, output_dir=output_images_dir)
+        )
+        saved_images = [path for _, path in image_info]
+    else:
+        content = "".join(str(page) + "\n\n---\n\n" for page in finished)
+        saved_images = []
+
+    return ConversionResult(
+        content=content,
+        pages=pages,
+        failed_pages=failed_pages,
+        image_paths=saved_images,
+    )
+
+
+def convert_document(*args, **kwargs) -> ConversionResult:
+    """aconvert_document的同步封装，在事件循环内部调用也是安全的"""
+    return run_sync(aconvert_document(*args, **kwargs))
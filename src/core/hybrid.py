@@ -0,0 +1,442 @@
+# hybrid.py
+import asyncio
+import html
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from bs4 import BeautifulSoup
+
+from src.core.async_utils import run_sync
+from src.utils.html_extractor import _parse_bbox
+
+# 文本块中乱码、私有区和控制字符的比例超过该值时视为文本层不可靠
+MAX_GARBLED_RATIO = 0.05
+# 不可靠文本占页面文本面积超过该比例时整页交给模型
+MAX_GARBLED_AREA_RATIO = 0.5
+# 文本块中数学字符（含数学字体）的比例超过该值时视为公式
+MIN_MATH_RATIO = 0.3
+# 字号超过正文字号该倍数时视为标题（h2），超过H1_SIZE_RATIO时视为一级标题
+HEADING_SIZE_RATIO = 1.2
+H1_SIZE_RATIO = 1.6
+# 单张图像覆盖超过该比例的页面视为扫描页，整页交给模型
+SCAN_COVERAGE_RATIO = 0.8
+# 矢量图：聚类中至少包含的路径数和最小边长（pt）
+MIN_FIGURE_PATHS = 8
+MIN_FIGURE_SIZE = 36
+# 小于该边长（pt）的位图（图标、项目符号）不作为图像输出
+MIN_IMAGE_SIZE = 12
+# 区域截图的外扩边距（pt）
+REGION_PADDING = 4
+# 需要发送给模型的区域类型
+VLM_KINDS = ("table", "formula", "uncertain")
+
+MATH_FONT_PATTERN = re.compile(r'math|cmmi|cmsy|cmex|symbol|stix|esint', re.IGNORECASE)
+# 与希腊字母同时出现时说明文本块是公式的ASCII运算符
+MATH_ASCII_OPERATORS = "=+<>^"
+
+
+def _is_math_char(char):
+    """数学运算符和数学字母数字符号"""
+    return (
+        '\u2200' <= char <= '\u22ff'
+        or '\U0001d400' <= char <= '\U0001d7ff'
+        or char in '\u221a\u221e\u00b1\u00d7\u00f7'
+    )
+
+
+def _is_greek_char(char):
+    """希腊字母，单独出现时可能是希腊语正文"""
+    return '\u0391' <= char <= '\u03c9'
+
+
+def _is_garbled_char(char):
+    """替换字符、私有区字符和控制字符，通常来自缺少ToUnicode映射的字体"""
+    return char == '\ufffd' or '\ue000' <= char <= '\uf8ff' or (ord(char) < 32 and char not in '\t\n')
+
+
+def _block_text(block):
+    """拼接文本块各行，行尾连字符与下一行小写开头的单词合并"""
+    text = ""
+    for line in block.get("lines", []):
+        line_text = "".join(span.get("text", "") for span in line.get("spans", [])).strip()
+        if not line_text:
+            continue
+        if text.endswith("-") and line_text[0].islower():
+            text = text[:-1] + line_text
+        elif text:
+            text += " " + line_text
+        else:
+            text = line_text
+    return text
+
+
+def _block_chars(block):
+    """统计文本块的非空白字符数、数学字符数和乱码字符数，以及最大字号"""
+    total = math_chars = greek = garbled = 0
+    has_operator = False
+    max_size = 0
+    for line in block.get("lines", []):
+        for span in line.get("spans", []):
+            chars = [c for c in span.get("text", "") if not c.isspace()]
+            if not chars:
+                continue
+            total += len(chars)
+            if MATH_FONT_PATTERN.search(span.get("font", "")):
+                math_chars += len(chars)
+            else:
+                math_chars += sum(1 for c in chars if _is_math_char(c))
+                greek += sum(1 for c in chars if _is_greek_char(c))
+                has_operator = has_operator or any(c in MATH_ASCII_OPERATORS for c in chars)
+            garbled += sum(1 for c in chars if _is_garbled_char(c))
+            max_size = max(max_size, span.get("size", 0))
+    if math_chars or has_operator:
+        # 希腊字母只在与数学符号、运算符或数学字体同时出现时计为数学字符
+        math_chars += greek
+    return total, math_chars, garbled, max_size
+
+
+def _body_font_size(blocks):
+    """按字符数加权的最常见字号，作为正文字号"""
+    sizes = Counter()
+    for block in blocks:
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                sizes[round(span.get("size", 0), 1)] += len(span.get("text", "").strip())
+    return sizes.most_common(1)[0][0] if sizes else 0
+
+
+def _inside_any(rect, areas):
+    """rect的中心是否落在任一区域内"""
+    center = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+    return any(center in area for area in areas)
+
+
+def _table_rows_html(rows):
+    """将fitz抽取的表格单元格转换为HTML表格行"""
+    return "".join(
+        "<tr>" + "".join(f"<td>{html.escape(cell or '')}</td>" for cell in row) + "</tr>"
+        for row in rows
+    )
+
+
+class HybridExtractor:
+    """
+    区域级混合抽取
+
+    文本层可靠的文本块直接取自fitz（保留位置，按字号识别标题），只有表格、公式和文本层不可靠的区域
+    截图后作为小请求并发发送给模型；图像区域直接输出为图像div，由combine_html_contents截取。
+    各区域按阅读顺序合并为与qwen_vl_html相同格式的单页HTML。
+    没有文本层或以整页图像为主（扫描件）的页面退回整页处理。
+    """
+
+    def __init__(self, processor, pdf_processor):
+        """
+        Args:
+            processor: LLMProcessor实例
+            pdf_processor: PDFProcessor实例，负责页面渲染和重复区域检测
+        """
+        self.processor = processor
+        self.pdf_processor = pdf_processor
+        # fitz文档对象非线程安全，打开、渲染和分析固定在单线程中执行，不阻塞事件循环
+        self.render_executor = ThreadPoolExecutor(1)
+        # 文本块、区域请求、图像、整页回退数量及发送给模型的像素数
+        self.stats = Counter()
+
+    async def aprocess_document(self, pdf_path, images_dir, max_tokens=4096):
+        """
+        混合抽取整个PDF
+
+        Args:
+            pdf_path: 输入PDF路径
+            images_dir: 页面图片目录，区域截图保存在其下的regions子目录
+            max_tokens: 单个请求的最大输出token数
+
+        Returns:
+            list: 按页序排列的结果，格式与process_images_batch在qwen_vl_html下的返回值一致
+        """
+        regions_dir = os.path.join(images_dir, "regions")
+        Path(regions_dir).mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        pages = []
+
+        def submit(image_path):
+            return loop.run_in_executor(
+                self.processor.executor, self.processor.process_image, image_path, "qwen_vl_html", max_tokens
+            )
+
+        doc = await loop.run_in_executor(self.render_executor, self._open_document, pdf_path)
+        try:
+            # 渲染和分析在渲染线程按页执行，区域请求在事件循环中提交后即开始下一页
+            for page_num in range(len(doc)):
+                image_path, regions = await loop.run_in_executor(
+                    self.render_executor, self._prepare_page, doc, page_num, images_dir, regions_dir
+                )
+                if regions is None:
+                    pages.append({"page": page_num + 1, "image_path": image_path, "future": submit(image_path)})
+                    continue
+                for region in regions:
+                    if region["kind"] in VLM_KINDS:
+                        region["future"] = submit(region.pop("crop_path"))
+                pages.append({"page": page_num + 1, "image_path": image_path, "regions": regions})
+        except BaseException:
+            for page in pages:
+                for future in [page.get("future")] + [r.get("future") for r in page.get("regions", [])]:
+                    if future is not None:
+                        future.cancel()
+            raise
+        finally:
+            # 排在渲染线程已提交的任务之后关闭
+            self.render_executor.submit(doc.close)
+
+        return [await self._assemble_page(page) for page in pages]
+
+    def _open_document(self, pdf_path):
+        """在渲染线程中打开文档并检测跨页重复区域"""
+        doc = fitz.open(pdf_path)
+        self.pdf_processor.prepare_document(doc)
+        return doc
+
+    def _prepare_page(self, doc, page_num, images_dir, regions_dir):
+        """
+        在渲染线程中渲染并分析单页，截取需要模型识别的区域
+
+        Returns:
+            tuple: (页面图像路径, 区域列表)；区域列表为None表示整页处理，
+                   需要模型识别的区域带有crop_path和origin
+        """
+        image_path = self.pdf_processor.render_page(doc, page_num, images_dir)
+        signals = self.pdf_processor.page_signals[image_path]
+        page = doc.load_page(page_num)
+        regions = self.analyze_page(page, page_num + 1)
+        if regions is None:
+            self.stats["full_pages"] += 1
+            self.stats["vlm_pixels"] += signals["pixels"]
+            return image_path, None
+
+        scale = signals["dpi"] / 72
+        for index, region in enumerate(regions):
+            region["bbox"] = [int(v * scale) for v in region["rect"]]
+            if region["kind"] in VLM_KINDS:
+                region["crop_path"], region["origin"], pixels = self._render_region(
+                    page, region["rect"], signals["dpi"], regions_dir, page_num + 1, index
+                )
+                self.stats["vlm_regions"] += 1
+                self.stats["vlm_pixels"] += pixels
+            elif region["kind"] == "figure":
+                self.stats["figures"] += 1
+            else:
+                self.stats["text_blocks"] += 1
+        return image_path, regions
+
+    def process_document(self, *args, **kwargs):
+        """aprocess_document的同步封装"""
+        return run_sync(self.aprocess_document(*args, **kwargs))
+
+    def analyze_page(self, page, page_number):
+        """
+        将页面划分为文本、图像、表格、公式和不可靠文本区域
+
+        Args:
+            page: fitz.Page对象
+            page_number: 页码（从1开始），用于排除重复区域
+
+        Returns:
+            list: 按阅读顺序排列的区域，每项包含kind、rect，文本区域包含tag和text，
+                  发送给模型的区域包含请求失败时使用的fallback（标签, 内容）；需要整页处理时返回None
+        """
+        blocks = [
+            block for block in page.get_text("dict").get("blocks", [])
+            if block.get("type") == 0 and _block_text(block)
+        ]
+        if not blocks:
+            return None
+
+        page_area = page.rect.width * page.rect.height
+        image_rects = [fitz.Rect(info["bbox"]) & page.rect for info in page.get_image_info()]
+        if any(rect.width * rect.height >= SCAN_COVERAGE_RATIO * page_area for rect in image_rects):
+            return None
+
+        regions = []
+        for table in self._find_tables(page):
+            regions.append({
+                "kind": "table", "rect": fitz.Rect(table.bbox), "fallback": ("table", _table_rows_html(table.extract()))
+            })
+        occupied = [region["rect"] for region in regions]
+        for rect in image_rects + self._vector_figures(page, occupied):
+            if min(rect.width, rect.height) < MIN_IMAGE_SIZE or _inside_any(rect, occupied):
+                continue
+            regions.append({"kind": "figure", "rect": rect})
+            occupied.append(rect)
+
+        masked = [
+            fitz.Rect(rect)
+            for region in self.pdf_processor.repeated_regions
+            for rect in region["rects"].get(page_number, [])
+        ]
+        body_size = _body_font_size(blocks)
+        text_area = garbled_area = 0
+        for block in blocks:
+            rect = fitz.Rect(block["bbox"])
+            if _inside_any(rect, masked) or _inside_any(rect, occupied):
+                continue
+            text = _block_text(block)
+            total, math_chars, garbled, max_size = _block_chars(block)
+            area = rect.width * rect.height
+            text_area += area
+            escaped = html.escape(text)
+            if total and garbled / total > MAX_GARBLED_RATIO:
+                garbled_area += area
+                regions.append({"kind": "uncertain", "rect": rect, "fallback": ("p", escaped)})
+            elif total and math_chars / total >= MIN_MATH_RATIO:
+                regions.append({"kind": "formula", "rect": rect, "fallback": ("div", escaped)})
+            else:
+                if body_size and max_size >= body_size * H1_SIZE_RATIO:
+                    tag = "h1"
+                elif body_size and max_size >= body_size * HEADING_SIZE_RATIO:
+                    tag = "h2"
+                else:
+                    tag = "p"
+                regions.append({"kind": "text", "rect": rect, "tag": tag, "text": escaped})
+
+        if text_area and garbled_area / text_area > MAX_GARBLED_AREA_RATIO:
+            return None
+        return self.reading_order(regions, page.rect)
+
+    @staticmethod
+    def reading_order(regions, page_rect):
+        """
+        按阅读顺序排列区域：跨越页面中线的区域作为分隔，分隔之间先左栏后右栏，栏内自上而下
+
+        Args:
+            regions: 区域列表
+            page_rect: 页面矩形
+
+        Returns:
+            list: 排序后的区域
+        """
+        mid = page_rect.x0 + page_rect.width / 2
+        ordered, left, right = [], [], []
+
+        def flush():
+            ordered.extend(sorted(left, key=lambda r: r["rect"].y0))
+            ordered.extend(sorted(right, key=lambda r: r["rect"].y0))
+            left.clear()
+            right.clear()
+
+        for region in sorted(regions, key=lambda r: (r["rect"].y0, r["rect"].x0)):
+            rect = region["rect"]
+            if rect.x1 <= mid:
+                left.append(region)
+            elif rect.x0 >= mid:
+                right.append(region)
+            else:
+                flush()
+                ordered.append(region)
+        flush()
+        return ordered
+
+    @staticmethod
+    def _find_tables(page):
+        """检测页面中的表格，fitz无法分析时返回空列表"""
+        try:
+            return list(page.find_tables().tables)
+        except Exception as e:
+            print(f"表格检测失败: {e}")
+            return []
+
+    @staticmethod
+    def _vector_figures(page, occupied):
+        """将相邻的矢量路径聚类，路径足够多且尺寸足够大的聚类视为矢量图（图表、示意图）"""
+        page_area = page.rect.width * page.rect.height
+        clusters = []  # [x0, y0, x1, y1, 路径数]
+        for drawing in page.get_drawings():
+            # 直线的矩形高度或宽度为0，fitz会将其视为空矩形，因此用坐标直接聚类
+            x0, y0, x1, y1 = drawing["rect"]
+            rect = fitz.Rect(x0, y0, x1, y1)
+            # 跳过页面背景和表格线
+            if (x1 - x0) * (y1 - y0) > 0.9 * page_area or _inside_any(rect, occupied):
+                continue
+            merged = [x0, y0, x1, y1, 1]
+            remaining = []
+            for cluster in clusters:
+                if (cluster[0] <= x1 + 3 and x0 - 3 <= cluster[2]
+                        and cluster[1] <= y1 + 3 and y0 - 3 <= cluster[3]):
+                    merged = [
+                        min(merged[0], cluster[0]), min(merged[1], cluster[1]),
+                        max(merged[2], cluster[2]), max(merged[3], cluster[3]),
+                        merged[4] + cluster[4]
+                    ]
+                else:
+                    remaining.append(cluster)
+            clusters = remaining + [merged]
+        return [
+            fitz.Rect(x0, y0, x1, y1) & page.rect for x0, y0, x1, y1, count in clusters
+            if count >= MIN_FIGURE_PATHS and min(x1 - x0, y1 - y0) >= MIN_FIGURE_SIZE
+        ]
+
+    @staticmethod
+    def _render_region(page, rect, dpi, regions_dir, page_number, index):
+        """
+        以页面DPI渲染区域截图
+
+        Returns:
+            tuple: (截图路径, 截图左上角在页面图像中的像素坐标, 截图像素数)
+        """
+        clip = (rect + (-REGION_PADDING, -REGION_PADDING, REGION_PADDING, REGION_PADDING)) & page.rect
+        pix = page.get_pixmap(dpi=dpi, clip=clip, alpha=False)
+        crop_path = os.path.join(regions_dir, f"page_{page_number:03d}_region_{index:03d}.png")
+        pix.save(crop_path)
+        scale = dpi / 72
+        return crop_path, (int(clip.x0 * scale), int(clip.y0 * scale)), pix.width * pix.height
+
+    async def _assemble_page(self, page):
+        """等待本页的模型请求并按阅读顺序合并为单页HTML"""
+        if "future" in page:
+            return await page["future"]
+
+        parts = []
+        model = None
+        for region in page["regions"]:
+            bbox = " ".join(str(v) for v in region["bbox"])
+            kind = region["kind"]
+            if kind == "text":
+                parts.append(f'<{region["tag"]} data-bbox="{bbox}">{region["text"]}</{region["tag"]}>')
+            elif kind == "figure":
+                parts.append(f'<div class="image" data-bbox="{bbox}"><img></div>')
+            else:
+                try:
+                    result = await region["future"]
+                except Exception as e:
+                    print(f"第{page['page']}页区域请求失败，使用文本层内容: {e}")
+                    tag, inner = region["fallback"]
+                    class_attr = ' class="formula"' if kind == "formula" else ''
+                    parts.append(f'<{tag}{class_attr} data-bbox="{bbox}">{inner}</{tag}>')
+                    continue
+                model = model or result.get("model")
+                parts.append(self._region_html(result["content"]["html_content"], region["origin"]))
+
+        return {
+            "page": page["page"],
+            "model": model,
+            "content": {
+                "html_content": "<html><body>\n" + "\n".join(parts) + "\n</body></html>",
+                "original_image_path": page["image_path"]
+            }
+        }
+
+    @staticmethod
+    def _region_html(html_str, origin):
+        """取区域结果的body内容，并将其中的bbox从截图坐标平移到页面图像坐标"""
+        soup = BeautifulSoup(html_str, 'html.parser')
+        for tag in soup.find_all(attrs={'data-bbox': True}):
+            bbox = _parse_bbox(tag.get('data-bbox'))
+            if bbox:
+                tag['data-bbox'] = " ".join(
+                    str(v + origin[i % 2]) for i, v in enumerate(bbox)
+                )
+        body = soup.body or soup
+        return body.decode_contents().strip()
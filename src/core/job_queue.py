@@ -0,0 +1,232 @@
+# job_queue.py
+import json
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    pdf_path TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    options TEXT NOT NULL,
+    page_count INTEGER,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    doc_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    page INTEGER,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, lease_expires);
+CREATE INDEX IF NOT EXISTS idx_tasks_doc ON tasks(doc_id, kind, page);
+"""
+
+
+class SQLiteJobQueue:
+    """
+    基于SQLite的任务队列，可放在多台机器共享的卷上
+
+    任务分为document（渲染PDF并拆分页面任务）和page（单页LLM处理）两类。
+    worker租用任务并定期续租；租约过期的任务（worker崩溃）会被其他worker自动重新租用。
+    网络文件系统上不使用WAL模式，保持默认的回滚日志。
+    """
+
+    def __init__(self, db_path, lease_seconds=120, max_attempts=3):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+            lease_seconds: 任务租约时长（秒）
+            max_attempts: 单个任务的最大尝试次数，超过后标记为failed
+        """
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        conn = sqlite3.connect(db_path, timeout=60)
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """每次操作使用独立连接和写事务，连接可安全地在多线程、多进程间使用"""
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _expire(self, conn, now):
+        """租约过期且已达到最大尝试次数的任务标记为failed"""
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', error = COALESCE(error, 'lease expired') "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts)
+        )
+
+    def submit_document(self, pdf_path, output_dir, options: dict) -> str:
+        """提交一个文档，返回doc_id"""
+        doc_id = uuid.uuid4().hex
+        payload = json.dumps({"pdf_path": pdf_path, "output_dir": output_dir, "options": options})
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO documents (doc_id, pdf_path, output_dir, options, created) VALUES (?, ?, ?, ?, ?)",
+                (doc_id, pdf_path, output_dir, json.dumps(options), time.time())
+            )
+            conn.execute(
+                "INSERT INTO tasks (doc_id, kind, payload) VALUES (?, 'document', ?)",
+                (doc_id, payload)
+            )
+        return doc_id
+
+    def lease(self, worker_id) -> Optional[dict]:
+        """
+        租用一个待处理或租约已过期的任务，页面任务优先
+
+        Returns:
+            dict: 任务信息（task_id、doc_id、kind、page、payload），没有任务时返回None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire(conn, now)
+            row = conn.execute(
+                """
+                SELECT * FROM tasks
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                  AND attempts < ?
+                ORDER BY kind = 'document', task_id
+                LIMIT 1
+                """,
+                (now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE task_id = ?",
+                (worker_id, now + self.lease_seconds, row["task_id"])
+            )
+        return {
+            "task_id": row["task_id"],
+            "doc_id": row["doc_id"],
+            "kind": row["kind"],
+            "page": row["page"],
+            "payload": json.loads(row["payload"]),
+        }
+
+    def heartbeat(self, task_id, worker_id) -> bool:
+        """续租，返回False表示租约已被其他worker接管"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id, result=None) -> bool:
+        """提交任务结果，租约已被接管时忽略并返回False"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', result = ?, lease_expires = NULL "
+                "WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), task_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error: str):
+        """记录失败；未达到最大尝试次数时重新排队"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, lease_expires = NULL WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, error, task_id, worker_id)
+            )
+
+    def complete_document(self, task_id, worker_id, doc_id, pages: List[dict]) -> bool:
+        """完成文档任务，并在同一事务中写入页数和所有页面任务"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL "
+                "WHERE task_id = ? AND worker = ? AND status = 'leased'",
+                (task_id, worker_id)
+            )
+            if cursor.rowcount != 1:
+                return False
+            conn.execute("UPDATE documents SET page_count = ? WHERE doc_id = ?", (len(pages), doc_id))
+            conn.executemany(
+                "INSERT INTO tasks (doc_id, kind, page, payload) VALUES (?, 'page', ?, ?)",
+                [(doc_id, page["page"], json.dumps(page)) for page in pages]
+            )
+        return True
+
+    def document_progress(self, doc_id) -> dict:
+        """
+        查询文档进度
+
+        Returns:
+            dict: page_count（未拆分时为None）以及各状态的任务数
+        """
+        with self._transaction() as conn:
+            self._expire(conn, time.time())
+            doc = conn.execute("SELECT page_count FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM tasks WHERE doc_id = ? GROUP BY status", (doc_id,)
+            ).fetchall()
+        progress = {"page_count": doc["page_count"] if doc else None}
+        progress.update({row["status"]: row["n"] for row in rows})
+        return progress
+
+    def has_unfinished(self) -> bool:
+        """队列中是否还有任何文档的待处理或已租用任务（已租用的文档任务完成后会产生页面任务）"""
+        with self._transaction() as conn:
+            self._expire(conn, time.time())
+            row = conn.execute(
+                "SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def page_results(self, doc_id) -> list:
+        """按页码顺序返回文档所有页面的结果"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT result FROM tasks WHERE doc_id = ? AND kind = 'page' AND status = 'done' ORDER BY page",
+                (doc_id,)
+            ).fetchall()
+        return [json.loads(row["result"]) for row in rows]
+
+    def wait_for_document(self, doc_id, poll_interval=2.0, timeout=None) -> list:
+        """
+        等待文档所有任务完成并返回页面结果
+
+        Raises:
+            RuntimeError: 有任务最终失败时抛出
+            TimeoutError: 超时时抛出
+        """
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            progress = self.document_progress(doc_id)
+            if progress.get("failed"):
+                raise RuntimeError(f"文档 {doc_id} 有 {progress['failed']} 个任务失败")
+            if progress["page_count"] is not None and not progress.get("pending") and not progress.get("leased"):
+                return self.page_results(doc_id)
+            if deadline and time.time() > deadline:
+                raise TimeoutError(f"等待文档 {doc_id} 超时: {progress}")
+            time.sleep(poll_interval)
@@ -4,12 +4,40 @@ from pydantic import BaseModel
 import base64
 import yaml
 from pathlib import Path
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 from src.core.api_clients.openai_client import OpenAIClient
+from src.core.api_clients.failover_client import FailoverClient
+from src.core.api_clients.transport import RecordReplayClient, ReplayMissError
 from src.core.prompt_manager import PromptManager
+from src.core.refinement import MODEL_MARKER, RefinementStage
+from src.core.scheduler import PageCostEstimator
+from src.core.async_utils import Deadline, DeadlineExceeded, run_sync
+from src.utils.profiler import profiler
 from concurrent.futures import ThreadPoolExecutor
 from typing import List
 import asyncio
+import threading
+import time
+
+CONTINUATION_PROMPT = (
+    "Your previous output was cut off. Continue exactly from where it stopped, "
+    "without repeating any content and without any explanation."
+)
+# 拼接续写内容时检查重叠的最大字符数
+MAX_OVERLAP_CHARS = 500
+# 认定为重复的最小重叠字符数（不足时须恰好是完整的行），避免误删"10"+"0 apples"这类正确续写
+MIN_OVERLAP_CHARS = 16
+
+_retry_backoff = wait_exponential(multiplier=1, min=4, max=10)
+
+
+def _wait_within_deadline(retry_state):
+    """指数退避等待，不超过页面截止时间的剩余时间"""
+    wait = _retry_backoff(retry_state)
+    deadline = retry_state.kwargs.get("deadline")
+    remaining = deadline.remaining() if deadline is not None else None
+    return wait if remaining is None else min(wait, remaining)
+
 # 定义输出结构
 class ExtractionResult(BaseModel):
     content: str
@@ -27,50 +55,135 @@ class LLMProcessor:
         self.client = self._init_client(settings)
         # 创建线程池
         self.executor = ThreadPoolExecutor(settings.MAX_WORKERS)
+        # 页面成本估算（基于历史输出token统计）
+        self.cost_estimator = PageCostEstimator(settings.STATS_PATH)
+        # 记录当前线程最近一次请求的输出token数
+        self._local = threading.local()
         
     
     def _init_client(self, settings):
     
         
+        # 同步请求无法从协程侧中断，每次请求都以REQUEST_TIMEOUT为上限；
+        # 重试由tenacity在检查截止时间后进行，客户端不再自行重试
         self.client = OpenAI(
             api_key=settings.OPENAI_API_KEY,
-            base_url=settings.API_BASE
+            base_url=settings.API_BASE,
+            timeout=settings.REQUEST_TIMEOUT,
+            max_retries=0
         )
+        if settings.FALLBACK_VISION_MODEL:
+            # 配置了备用模型时启用熔断切换
+            self.client = FailoverClient(settings, primary=self.client)
+        if settings.TRANSPORT_MODE in ("record", "replay"):
+            # 记录原始响应，或离线回放已记录的响应
+            self.client = RecordReplayClient(self.client, settings.TRANSPORT_ARCHIVE, settings.TRANSPORT_MODE)
         return self.client
         
-    async def async_process_images_concurrent(self, image_paths: List[str], doc_type="default", max_tokens=32768, json_mode=False,parse_type='markdown'):
-        """并发处理多个图片"""
+    async def async_process_images_concurrent(self, image_paths: List[str], doc_type="default", max_tokens=32768, json_mode=False,parse_type='markdown',
+                                              refine=False, refine_doc_type=None, page_signals=None, schedule="cost",
+                                              page_timeout=None, deadline=None):
+        """
+        并发处理多个图片，可选地在抽取的同时流水线润色
+        
+        schedule为"cost"时按估算成本从高到低提交页面，结果仍按输入顺序返回；
+        page_signals为PDFProcessor.page_signals，用于成本估算和历史统计。
+        page_timeout为单页超时（秒），超时页面的结果为None；deadline为文档级Deadline。
+        协程被取消时，尚未开始的页面不再执行，已开始的请求在下一次检查点放弃。
+        """
         loop = asyncio.get_event_loop()
-        tasks = []
+        page_signals = page_signals or {}
+        if schedule == "cost":
+            order = self.cost_estimator.schedule(image_paths, doc_type, page_signals)
+        else:
+            order = range(len(image_paths))
+        tasks = [None] * len(image_paths)
+        # 本批次的取消标记（继承文档级截止时间）；单页截止时间在worker开始处理该页时才创建
+        batch_deadline = Deadline(parent=deadline) if page_timeout or deadline else None
         
-        for image_path in image_paths:
+        for index in order:
+            image_path = image_paths[index]
             # 使用线程池执行API调用
-            task = loop.run_in_executor(
+            future = loop.run_in_executor(
                 self.executor,
-                self.process_image,
+                self._process_and_record,
                 image_path,
                 doc_type,
                 max_tokens,
                 json_mode,
-                parse_type
+                parse_type,
+                page_signals.get(image_path),
+                batch_deadline,
+                page_timeout
             )
-            tasks.append(task)
+            tasks[index] = asyncio.ensure_future(self._await_page(future, batch_deadline)) if deadline else future
             
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks)
+        try:
+            if refine:
+                # 润色阶段按页序消费已完成的页面，与抽取重叠执行
+                stage = RefinementStage(self, doc_type=refine_doc_type or doc_type)
+                results = await stage.run(tasks)
+            else:
+                # 等待所有任务完成
+                results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 调用方放弃（取消或文档超时）：撤销排队中的页面并通知运行中的页面
+            if batch_deadline is not None:
+                batch_deadline.cancel()
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            self.cost_estimator.save()
         return results
 
-    def process_images_batch(self, image_paths: List[str], doc_type="default", max_tokens=32768,json_mode=False,parse_type='markdown'):
-        """批量处理图片的同步方法封装"""
-        loop = asyncio.get_event_loop()
-        results = loop.run_until_complete(
-            self.async_process_images_concurrent(image_paths, doc_type, max_tokens,json_mode,parse_type)
+    @staticmethod
+    async def _await_page(future, deadline):
+        """等待单页结果，超过文档截止时间时放弃；单页超时由worker端处理"""
+        try:
+            return await asyncio.wait_for(future, deadline.remaining())
+        except asyncio.TimeoutError:
+            deadline.cancel()
+            raise DeadlineExceeded("文档处理超过截止时间")
+
+    def process_images_batch(self, image_paths: List[str], doc_type="default", max_tokens=32768,json_mode=False,parse_type='markdown',
+                             refine=False, refine_doc_type=None, page_signals=None, schedule="cost"):
+        """批量处理图片的同步方法封装，可在运行中的事件循环内安全调用"""
+        return run_sync(
+            self.async_process_images_concurrent(image_paths, doc_type, max_tokens,json_mode,parse_type,
+                                                 refine=refine, refine_doc_type=refine_doc_type,
+                                                 page_signals=page_signals, schedule=schedule)
         )
-        return results
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def process_image(self, image_input, doc_type="default", max_tokens=32768, json_mode=False, parse_type=None)-> ExtractionResult:
+    def _process_and_record(self, image_path, doc_type, max_tokens, json_mode, parse_type, signals=None, deadline=None,
+                            page_timeout=None):
+        """
+        处理单页并将实际输出token数和耗时记入历史统计
+
+        page_timeout从worker开始处理该页时计时，在线程池中排队的时间不计入；
+        单页超时返回None，deadline（文档级或批次取消）到期时抛出DeadlineExceeded。
+        """
+        start = time.monotonic()
+        page_deadline = Deadline.after(page_timeout, parent=deadline) if page_timeout else deadline
         try:
+            result = self.process_image(image_path, doc_type, max_tokens, json_mode, parse_type, deadline=page_deadline)
+        except DeadlineExceeded:
+            if page_deadline is deadline or deadline is not None and (deadline.cancelled or deadline.remaining() == 0):
+                raise
+            print(f"页面处理超时，已跳过: {image_path}")
+            return None
+        completion_tokens = getattr(self._local, "completion_tokens", 0)
+        if completion_tokens:
+            self.cost_estimator.record(doc_type, completion_tokens, signals, time.monotonic() - start)
+        return result
+
+    @retry(stop=stop_after_attempt(3), wait=_wait_within_deadline,
+           retry=retry_if_not_exception_type((DeadlineExceeded, ReplayMissError)))
+    def process_image(self, image_input, doc_type="default", max_tokens=32768, json_mode=False, parse_type=None,
+                      deadline: Deadline = None)-> ExtractionResult:
+        try:
+            if deadline:
+                deadline.check()
             # 获取动态提示词
             system_prompt =  self.prompt_manager.get_prompt(doc_type, "system_prompt")
             prompt = self.prompt_manager.get_prompt(doc_type, "extraction")
@@ -79,7 +192,8 @@ class LLMProcessor:
         
             
             # 处理不同类型的图像输入
-            image_url = self._get_image_url(image_input)
+            with profiler.span("encode", image=str(image_input)):
+                image_url = self._get_image_url(image_input)
 
 
             # 构建消息
@@ -120,27 +234,126 @@ class LLMProcessor:
             if json_mode:
                 api_params["response_format"] = {"type": "json_object"}
                 
-            response = self.client.chat.completions.create(**api_params)
-            # return self._parse_response(response, parse_type=parse_type)
-            parsed_response = self._parse_response(response, parse_type=parse_type)
+            with profiler.span("request", image=str(image_input)):
+                content = self._complete_with_continuation(api_params, deadline)
+            parsed_response = self._parse_content(content, parse_type=parse_type)
+            model = getattr(self._local, "model", None)
             if doc_type == "qwen_vl_html":
-                return self._format_page_content(image_input, parsed_response)
+                return self._format_page_content(image_input, parsed_response, model)
+            if isinstance(parsed_response, str) and model and self.settings.FALLBACK_VISION_MODEL:
+                # 启用熔断切换时，Markdown页面以注释行记录实际提供服务的模型
+                return f"{MODEL_MARKER.format(model)}\n{parsed_response}"
         
             return parsed_response
         
-            
+        except (DeadlineExceeded, ReplayMissError):
+            raise
         except Exception as e:
+            if deadline is not None and (deadline.cancelled or deadline.remaining() == 0):
+                # 截止时间已到（如请求超时），不再重试
+                raise DeadlineExceeded(f"处理图片超过截止时间: {str(e)}") from e
             raise ValueError(f"处理图片失败: {str(e)}")
     
+    def _create_completion(self, api_params, deadline: Deadline = None):
+        """
+        发送请求；有截止时间时先检查是否已放弃，剩余时间短于REQUEST_TIMEOUT时以剩余时间作为HTTP超时
+
+        客户端的默认超时为REQUEST_TIMEOUT，调用方取消后，进行中的请求最迟在该时间后释放线程，
+        之后的续写和重试在check()处放弃。
+        """
+        if deadline is None:
+            return self.client.chat.completions.create(**api_params)
+        deadline.check()
+        remaining = deadline.remaining()
+        if remaining is not None and remaining < self.settings.REQUEST_TIMEOUT:
+            api_params = dict(api_params, timeout=remaining)
+        return self.client.chat.completions.create(**api_params)
+
+    def _complete_with_continuation(self, api_params, deadline: Deadline = None) -> str:
+        """
+        调用API，输出因max_tokens被截断时发送续写请求并拼接结果
+
+        续写次数受settings.MAX_CONTINUATIONS限制，只有被截断的长页面才会产生额外请求。
+
+        Args:
+            api_params: chat.completions.create的参数
+            deadline: 页面截止时间，可为None
+
+        Returns:
+            str: 拼接后的完整原始输出
+        """
+        response = self._create_completion(api_params, deadline)
+        self._local.completion_tokens = self._completion_tokens(response)
+        # 记录实际提供服务的模型（熔断时可能是备用模型），续写请求可能由不同模型完成
+        models = [getattr(response, "model", None) or api_params.get("model")]
+        choice = response.choices[0]
+        content = choice.message.content or ""
+
+        continuations = 0
+        while choice.finish_reason == "length" and continuations < self.settings.MAX_CONTINUATIONS:
+            continuations += 1
+            params = dict(api_params)
+            params["messages"] = api_params["messages"] + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUATION_PROMPT},
+            ]
+            response = self._create_completion(params, deadline)
+            self._local.completion_tokens += self._completion_tokens(response)
+            models.append(getattr(response, "model", None) or api_params.get("model"))
+            choice = response.choices[0]
+            content = self._stitch_continuation(content, choice.message.content or "")
+
+        self._local.truncated = choice.finish_reason == "length"
+        if self._local.truncated:
+            print(f"警告: 续写{continuations}次后输出仍被截断")
+        self._local.model = ",".join(dict.fromkeys(m for m in models if m))
+        return content
+
+    @staticmethod
+    def _completion_tokens(response) -> int:
+        """读取响应中的输出token数，服务端未返回usage时为0"""
+        usage = getattr(response, "usage", None)
+        return getattr(usage, "completion_tokens", None) or 0
+
+    @staticmethod
+    def _stitch_continuation(partial: str, addition: str) -> str:
+        """去掉续写内容开头重复的代码块标记和与已有输出重叠的部分后拼接"""
+        stripped = addition.lstrip()
+        if stripped.startswith("```"):
+            # 续写重新打开了代码块，去掉这一行
+            newline = stripped.find("\n")
+            addition = stripped[newline + 1:] if newline != -1 else ""
+
+        max_overlap = min(len(partial), len(addition), MAX_OVERLAP_CHARS)
+        for size in range(max_overlap, 0, -1):
+            overlap = addition[:size]
+            if not partial.endswith(overlap):
+                continue
+            starts_line = size == len(partial) or partial[-size - 1] == "\n"
+            if size >= MIN_OVERLAP_CHARS or (starts_line and overlap.endswith("\n")):
+                addition = addition[size:]
+                break
+        return partial + addition
+
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def refine_text(
         self,
         text: str,
         doc_type: str = "default",
-        max_tokens: int = 4096
+        max_tokens: int = 4096,
+        extra_instruction: str = None
     )-> RefinementResult:
         """
         文本润色方法
+
+        Args:
+            text: 待润色文本
+            doc_type: 文档类型
+            max_tokens: 最大输出token数
+            extra_instruction: 追加在润色提示词之后的额外要求
+
+        Returns:
+            str: 润色后的文本；续写后输出仍被截断时返回None
         """
         try:
             # 1. 获取润色提示词
@@ -148,6 +361,8 @@ class LLMProcessor:
                 doc_type=doc_type,
                 stage="refinement"
             )
+            if extra_instruction:
+                prompt = f"{prompt.rstrip()}\n\n{extra_instruction}"
             
             # 2. 构建消息
             messages = [{
@@ -155,16 +370,19 @@ class LLMProcessor:
                 "content": f"{prompt}\n\n---\n\n{text}"
             }]
             
-            # 3. 调用文本API
-            response = self.client.chat.completions.create(
-                model=self.settings.TEXT_MODEL,
-                messages=messages,
-                temperature=0.1,
-                max_tokens=max_tokens
-            )
+            # 3. 调用文本API，输出被截断时续写
+            content = self._complete_with_continuation({
+                "model": self.settings.TEXT_MODEL,
+                "messages": messages,
+                "temperature": 0.1,
+                "max_tokens": max_tokens
+            })
+            if self._local.truncated:
+                # 续写后仍不完整，由调用方保留原始内容
+                return None
             
             # 4. 解析响应
-            return self._parse_response(response)
+            return self._parse_content(content)
         except Exception as e:
             raise ValueError(f"润色失败: {str(e)}")
 
@@ -223,12 +441,24 @@ class LLMProcessor:
             response: LLM的响应对象
             parse_type: 解析类型，支持 'markdown'、'json'和'html'，默认为 'markdown'
         
+        Returns:
+            str/dict: 根据parse_type返回提取的内容
+        """
+        content = response.choices[0].message.content
+        return self._parse_content(content, parse_type)
+
+    def _parse_content(self, content, parse_type='markdown'):
+        """
+        按parse_type解析原始输出文本
+        
+        Args:
+            content: LLM输出的原始文本
+            parse_type: 解析类型，支持 'markdown'、'json'和'html'
+        
         Returns:
             str/dict: 根据parse_type返回提取的内容
         """
         try:
-            content = response.choices[0].message.content
-            
             # 定义解析器映射
             parsers = {
                 'markdown': self._parse_code_block('markdown'),
@@ -260,6 +490,9 @@ class LLMProcessor:
                 return content.strip()
                 
             start = content.find("\n", start) + 1
+            if end < start:
+                # 没有结束标记（输出被截断），保留开始标记之后的全部内容
+                return content[start:].strip()
             return content[start:end].strip()
         
         return parser
@@ -288,13 +521,14 @@ class LLMProcessor:
             except json.JSONDecodeError:
                 return content
             
-    def _format_page_content(self, image_input: str, parsed_content: str) -> dict:
+    def _format_page_content(self, image_input: str, parsed_content: str, model: str = None) -> dict:
         """
         将解析后的内容和图片信息整合成统一格式
         
         Args:
             image_input: 输入图片路径
             parsed_content: 解析后的内容
+            model: 实际处理该页的模型
             
         Returns:
             dict: 包含页码和内容信息的字典
@@ -308,6 +542,7 @@ class LLMProcessor:
             
             return {
                 "page": page,
+                "model": model,
                 "content": {
                     "html_content": parsed_content,
                     "original_image_path": image_input
@@ -317,6 +552,7 @@ class LLMProcessor:
             # 如果解析失败，返回默认值
             return {
                 "page": 1,
+                "model": model,
                 "content": {
                     "html_content": parsed_content,
                     "original_image_path": image_input
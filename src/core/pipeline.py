@@ -0,0 +1,204 @@
+# pipeline.py
+import asyncio
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from src.core.async_utils import run_sync
+from src.utils.html_extractor import (
+    FigureStore,
+    HTML_DOCUMENT_HEAD,
+    HTML_DOCUMENT_TAIL,
+    format_document_furniture,
+    format_page_html,
+    process_html_content,
+)
+
+# 单页在途时除栅格图像外的固定开销（HTML树、响应文本、请求体等）
+PAGE_OVERHEAD_BYTES = 8 * 1024 * 1024
+# 栅格图像在渲染、PNG编码、base64和请求体中的副本倍数
+RASTER_COPIES = 4
+
+
+class StreamingPipeline:
+    """
+    内存受限的流式处理流水线
+
+    渲染、LLM请求和后处理三个阶段逐页流动，通过信号量限制在途页面数量形成背压；
+    处理完成的页面立即落盘，最终以流式方式拼接输出文件，峰值内存与页数无关。
+    """
+
+    def __init__(self, processor, pdf_processor, memory_budget_mb, figure_dpi=None):
+        """
+        Args:
+            processor: LLMProcessor实例
+            pdf_processor: PDFProcessor实例
+            memory_budget_mb: 在途页面可占用的内存预算（MB）
+            figure_dpi: 如果指定，则从源PDF以该DPI重新渲染图像区域
+        """
+        self.processor = processor
+        self.pdf_processor = pdf_processor
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.figure_dpi = figure_dpi
+        # fitz文档对象非线程安全，渲染固定在单线程中执行
+        self.render_executor = ThreadPoolExecutor(1)
+        # 图像索引跨页累积，后处理按页序在单线程中执行；
+        # 需要从PDF重新渲染图像区域时与渲染共用同一线程
+        self.post_executor = self.render_executor if figure_dpi else ThreadPoolExecutor(1)
+
+    def _max_in_flight(self, doc):
+        """根据首页尺寸估算单页内存占用，计算允许的在途页面数"""
+        if len(doc) == 0:
+            return 1
+        rect = doc.load_page(0).rect
+        pdf_processor = self.pdf_processor
+        # 自适应DPI时按上限估算
+        dpi = pdf_processor.max_dpi if pdf_processor.adaptive else pdf_processor.dpi
+        scale = dpi / 72
+        pixels = int(rect.width * scale) * int(rect.height * scale)
+        if pdf_processor.adaptive and pdf_processor.max_pixels:
+            pixels = min(pixels, pdf_processor.max_pixels)
+        raster_bytes = pixels * 3
+        page_bytes = raster_bytes * RASTER_COPIES + PAGE_OVERHEAD_BYTES
+        return max(1, self.memory_budget // page_bytes)
+
+    async def arun(self, pdf_path, images_dir, output_path, doc_type="default", max_tokens=4096,
+                   output_images_dir=None, chunks_path=None, chunk_tokens=512):
+        """
+        流式处理整个PDF并写出最终文件
+
+        Args:
+            pdf_path: 输入PDF路径
+            images_dir: 页面图片目录
+            output_path: 最终输出文件路径（.html或.md）
+            doc_type: 文档类型
+            max_tokens: LLM最大输出token数
+            output_images_dir: HTML模式下截取图像的保存目录
+            chunks_path: 如果指定，则边处理边写出RAG分块JSONL
+            chunk_tokens: 每个分块的目标token长度
+
+        Returns:
+            int: 处理的页数
+        """
+        Path(images_dir).mkdir(parents=True, exist_ok=True)
+        spill_dir = Path(output_path).parent / f".{Path(output_path).stem}_pages"
+        spill_dir.mkdir(parents=True, exist_ok=True)
+        is_html = doc_type == "qwen_vl_html"
+
+        doc = fitz.open(pdf_path)
+        self.pdf_processor.prepare_document(doc)
+        page_count = len(doc)
+        slots = asyncio.Semaphore(self._max_in_flight(doc))
+        turn = asyncio.Condition()
+        state = {"next_page": 0, "next_index": 1, "chunk_index": 0}
+        chunks_file = open(chunks_path, 'w', encoding='utf-8') if chunks_path else None
+        figure_store = FigureStore(output_images_dir or "images") if is_html else None
+        loop = asyncio.get_event_loop()
+
+        async def process_page(page_num):
+            error = None
+            try:
+                image_path = await loop.run_in_executor(
+                    self.render_executor, self.pdf_processor.render_page, doc, page_num, images_dir
+                )
+                result = await loop.run_in_executor(
+                    self.processor.executor, self.processor.process_image,
+                    image_path, doc_type, max_tokens, False, 'markdown'
+                )
+            except Exception as e:
+                error = e
+            try:
+                # 等待前序页面完成后处理，保证图像索引与输出顺序
+                async with turn:
+                    await turn.wait_for(lambda: state["next_page"] == page_num)
+                if error is None:
+                    await loop.run_in_executor(self.post_executor, self._post_process,
+                                               result, doc, page_num, spill_dir, is_html,
+                                               output_images_dir, chunks_file, chunk_tokens, state,
+                                               figure_store)
+            finally:
+                async with turn:
+                    state["next_page"] += 1
+                    turn.notify_all()
+                slots.release()
+            if error is not None:
+                raise error
+
+        try:
+            tasks = []
+            for page_num in range(page_count):
+                # 在途页面达到上限时阻塞渲染（背压）
+                await slots.acquire()
+                tasks.append(asyncio.ensure_future(process_page(page_num)))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            doc.close()
+            if figure_store:
+                figure_store.close()
+            if chunks_file:
+                chunks_file.close()
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise errors[0]
+
+        self._assemble(spill_dir, page_count, output_path, is_html)
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        return page_count
+
+    def run(self, *args, **kwargs):
+        """arun的同步封装"""
+        return run_sync(self.arun(*args, **kwargs))
+
+    def _post_process(self, result, doc, page_num, spill_dir, is_html, output_images_dir, chunks_file, chunk_tokens, state,
+                      figure_store=None):
+        """后处理单页结果并落盘"""
+        if is_html:
+            chunks = [] if chunks_file else None
+            content, _, _, state["next_index"] = process_html_content(
+                result["content"]["html_content"],
+                result["content"]["original_image_path"],
+                output_dir=output_images_dir or "images",
+                start_index=state["next_index"],
+                page_num=result["page"],
+                chunks=chunks,
+                chunk_tokens=chunk_tokens,
+                figure_store=figure_store,
+                source_page=doc.load_page(page_num) if self.figure_dpi else None,
+                figure_dpi=self.figure_dpi
+            )
+            text = format_page_html(result["page"], content, result.get("model"))
+            for chunk in chunks or []:
+                chunk["model"] = result.get("model")
+                chunk["chunk_index"] = state["chunk_index"]
+                state["chunk_index"] += 1
+                chunks_file.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        else:
+            text = str(result)
+
+        with open(self._spill_path(spill_dir, page_num), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    @staticmethod
+    def _spill_path(spill_dir, page_num):
+        return os.path.join(spill_dir, f"page_{page_num + 1:05d}.part")
+
+    def _assemble(self, spill_dir, page_count, output_path, is_html):
+        """按页序流式拼接落盘的页面，避免在内存中构建完整文档"""
+        with open(output_path, 'w', encoding='utf-8') as out:
+            if is_html:
+                out.write(HTML_DOCUMENT_HEAD)
+                out.write(format_document_furniture(self.pdf_processor.repeated_regions))
+            for page_num in range(page_count):
+                if is_html and page_num > 0:
+                    out.write('\n')
+                with open(self._spill_path(spill_dir, page_num), encoding='utf-8') as f:
+                    shutil.copyfileobj(f, out)
+                if not is_html:
+                    out.write("\n\n---\n\n")
+            if is_html:
+                out.write(HTML_DOCUMENT_TAIL)
@@ -0,0 +1,197 @@
+# planner.py
+import heapq
+import math
+import os
+from typing import List
+
+import fitz  # PyMuPDF
+
+from src.core.llm_integration import CONTINUATION_PROMPT
+from src.core.prompt_manager import PromptManager
+from src.core.scheduler import PageCostEstimator
+from src.utils.token_counter import estimate_tokens
+
+# Qwen2-VL图像缩放规则：边长对齐到28像素，每28x28像素对应一个视觉token
+IMAGE_FACTOR = 28
+MIN_IMAGE_PIXELS = 4 * 28 * 28
+# 每张图像额外的视觉起止token
+VISION_SPECIAL_TOKENS = 2
+# 聊天模板的固定开销（角色标记等）
+CHAT_TEMPLATE_TOKENS = 20
+# 渲染页面PNG的估算字节数/像素：文本区域压缩率高，图像区域接近未压缩
+PNG_BYTES_PER_PIXEL_TEXT = 0.3
+PNG_BYTES_PER_PIXEL_IMAGE = 2.0
+
+
+def smart_resize(height, width, factor=IMAGE_FACTOR, min_pixels=MIN_IMAGE_PIXELS, max_pixels=16384 * 28 * 28):
+    """
+    按qwen-vl-utils的smart_resize规则计算模型实际接收的图像尺寸
+
+    Returns:
+        tuple: (resized_height, resized_width)
+    """
+    h_bar = max(factor, round(height / factor) * factor)
+    w_bar = max(factor, round(width / factor) * factor)
+    if h_bar * w_bar > max_pixels:
+        beta = math.sqrt(height * width / max_pixels)
+        h_bar = max(factor, math.floor(height / beta / factor) * factor)
+        w_bar = max(factor, math.floor(width / beta / factor) * factor)
+    elif h_bar * w_bar < min_pixels:
+        beta = math.sqrt(min_pixels / (height * width))
+        h_bar = math.ceil(height * beta / factor) * factor
+        w_bar = math.ceil(width * beta / factor) * factor
+    return h_bar, w_bar
+
+
+def project_makespan(durations: List[float], workers: int) -> float:
+    """按最长处理时间优先（与页面调度一致）将任务分配给最空闲的worker，返回总耗时"""
+    loads = [0.0] * max(1, workers)
+    for duration in sorted(durations, reverse=True):
+        heapq.heappush(loads, heapq.heappop(loads) + duration)
+    return max(loads)
+
+
+class IngestPlanner:
+    """
+    不调用API的摄取计划估算
+
+    用fitz打开文档，按PDFProcessor的DPI选择和模型的缩放规则计算每页实际发送的像素和图像token，
+    按doc_type的提示词估算输入token，按历史统计估算输出token和耗时，
+    并按配置的并发数推算运行时间，同时估算pdf_images/和output_images/的磁盘占用。
+    """
+
+    def __init__(self, settings, pdf_processor, doc_type="qwen_vl_html", max_tokens=4096, figure_dpi=None):
+        """
+        Args:
+            settings: 配置对象（MAX_WORKERS、MAX_CONTINUATIONS、MAX_PAGE_PIXELS、STATS_PATH、PROMPTS_DIR）
+            pdf_processor: PDFProcessor实例，决定每页的渲染DPI
+            doc_type: 文档类型
+            max_tokens: 单次请求的最大输出token数
+            figure_dpi: 图像区域重新渲染的DPI，None表示从页面图像截取
+        """
+        self.settings = settings
+        self.pdf_processor = pdf_processor
+        self.doc_type = doc_type
+        self.max_tokens = max_tokens
+        self.figure_dpi = figure_dpi
+        self.cost_estimator = PageCostEstimator(settings.STATS_PATH)
+        prompt_manager = PromptManager(settings.PROMPTS_DIR)
+        self.prompt_tokens = CHAT_TEMPLATE_TOKENS + sum(
+            estimate_tokens(prompt_manager.get_prompt(doc_type, stage))
+            for stage in ("system_prompt", "extraction")
+        )
+        self.continuation_tokens = estimate_tokens(CONTINUATION_PROMPT)
+
+    def plan(self, pdf_paths: List[str]) -> dict:
+        """
+        估算一组文档的处理计划，文档按顺序逐个处理，页面在文档内并发
+
+        Returns:
+            dict: 可直接序列化为JSON的计划，包含assumptions、documents和totals
+        """
+        tokens_per_second = self.cost_estimator.tokens_per_second(self.doc_type)
+        history = self.cost_estimator.stats.get(self.doc_type, {})
+        documents = [self.plan_document(path, tokens_per_second) for path in pdf_paths]
+
+        totals = {
+            key: sum(doc[key] for doc in documents)
+            for key in ("pages", "requests", "input_tokens", "output_tokens", "runtime_seconds")
+        }
+        totals["disk_bytes"] = {
+            key: sum(doc["disk_bytes"][key] for doc in documents)
+            for key in ("pdf_images", "output_images")
+        }
+        minutes = totals["runtime_seconds"] / 60
+        totals["tokens_per_minute"] = (
+            round((totals["input_tokens"] + totals["output_tokens"]) / minutes) if minutes else 0
+        )
+        totals["requests_per_minute"] = round(totals["requests"] / minutes, 2) if minutes else 0
+
+        return {
+            "doc_type": self.doc_type,
+            "model": self.settings.VISION_MODEL,
+            "assumptions": {
+                "max_workers": self.settings.MAX_WORKERS,
+                "max_tokens": self.max_tokens,
+                "max_continuations": self.settings.MAX_CONTINUATIONS,
+                "max_image_pixels": self.settings.MAX_PAGE_PIXELS,
+                "prompt_tokens": self.prompt_tokens,
+                "tokens_per_second": round(tokens_per_second, 2),
+                "history_pages": history.get("pages", 0),
+                "history_source": self.settings.STATS_PATH if history.get("seconds") else None,
+            },
+            "documents": documents,
+            "totals": totals,
+        }
+
+    def plan_document(self, pdf_path: str, tokens_per_second: float) -> dict:
+        """估算单个文档，返回文档级汇总和逐页明细"""
+        pages = []
+        image_bytes = figure_bytes = 0
+        with fitz.open(pdf_path) as doc:
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                signals = self.pdf_processor.page_signals_of(page)
+                dpi = self.pdf_processor.choose_dpi(page, signals)
+                scale = dpi / 72
+                width, height = int(page.rect.width * scale), int(page.rect.height * scale)
+                signals.update(dpi=dpi, pixels=width * height)
+
+                resized_height, resized_width = smart_resize(
+                    height, width, max_pixels=self.settings.MAX_PAGE_PIXELS
+                )
+                image_tokens = resized_height * resized_width // (IMAGE_FACTOR * IMAGE_FACTOR) + VISION_SPECIAL_TOKENS
+                output_tokens = int(self.cost_estimator.estimate_completion_tokens(self.doc_type, signals))
+                # 超过max_tokens的部分由续写请求完成，续写次数受MAX_CONTINUATIONS限制
+                requests = min(max(1, math.ceil(output_tokens / self.max_tokens)), self.settings.MAX_CONTINUATIONS + 1)
+                output_tokens = min(output_tokens, requests * self.max_tokens)
+                # 续写请求会重新发送图像、提示词和已生成的内容
+                input_tokens = (image_tokens + self.prompt_tokens) * requests + sum(
+                    min(k * self.max_tokens, output_tokens) + self.continuation_tokens for k in range(1, requests)
+                )
+
+                figure_area = self._figure_area(page)
+                page_area = page.rect.width * page.rect.height or 1
+                image_fraction = min(figure_area / page_area, 1.0)
+                image_bytes += int(width * height * (
+                    PNG_BYTES_PER_PIXEL_TEXT * (1 - image_fraction) + PNG_BYTES_PER_PIXEL_IMAGE * image_fraction
+                ))
+                if self.doc_type == "qwen_vl_html":
+                    figure_scale = (self.figure_dpi or dpi) / 72
+                    figure_bytes += int(figure_area * figure_scale * figure_scale * PNG_BYTES_PER_PIXEL_IMAGE)
+
+                pages.append({
+                    "page": page_num + 1,
+                    "dpi": dpi,
+                    "width": width,
+                    "height": height,
+                    "resized_width": resized_width,
+                    "resized_height": resized_height,
+                    "image_tokens": image_tokens,
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "requests": requests,
+                    "seconds": round(output_tokens / tokens_per_second, 2),
+                })
+
+        runtime = project_makespan([p["seconds"] for p in pages], self.settings.MAX_WORKERS)
+        return {
+            "path": os.path.abspath(pdf_path),
+            "pages": len(pages),
+            "requests": sum(p["requests"] for p in pages),
+            "input_tokens": sum(p["input_tokens"] for p in pages),
+            "output_tokens": sum(p["output_tokens"] for p in pages),
+            "runtime_seconds": round(runtime, 2),
+            "disk_bytes": {"pdf_images": image_bytes, "output_images": figure_bytes},
+            "page_details": pages,
+        }
+
+    @staticmethod
+    def _figure_area(page):
+        """页面上位图的总面积（pt²），用于估算PNG大小和截取图像的磁盘占用"""
+        area = 0.0
+        for info in page.get_image_info():
+            rect = fitz.Rect(info["bbox"]) & page.rect
+            if not rect.is_empty:
+                area += rect.width * rect.height
+        return area
@@ -0,0 +1,157 @@
+# refinement.py
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from src.utils.token_counter import estimate_tokens
+
+PAGE_MARKER = "<!-- page: {} -->"
+PAGE_MARKER_PATTERN = re.compile(r'<!--\s*page:\s*(\d+)\s*-->')
+# Markdown页面开头记录处理模型的注释行，润色前取下、润色后放回
+MODEL_MARKER = "<!-- model: {} -->"
+MODEL_MARKER_PATTERN = re.compile(r'\A<!--\s*model:[^>]*-->\n?')
+MARKER_INSTRUCTION = (
+    "The text contains consecutive pages separated by marker lines such as `<!-- page: 3 -->`. "
+    "Keep every marker line unchanged and in order; a paragraph split across pages may be merged "
+    "into the page where it starts."
+)
+
+
+class RefinementStage:
+    """
+    润色流水线阶段
+
+    按页码顺序消费抽取结果，将连续页面打包到文本模型的上下文窗口中，
+    在独立的线程池中并发润色，与抽取阶段重叠执行。
+    """
+
+    def __init__(self, processor, doc_type="default", max_workers=None, context_tokens=None, max_tokens=None):
+        """
+        Args:
+            processor: LLMProcessor实例
+            doc_type: 润色使用的文档类型（决定refinement提示词）
+            max_workers: 润色并发数，默认读取settings.REFINE_WORKERS
+            context_tokens: 文本模型上下文长度，默认读取settings.TEXT_CONTEXT_TOKENS
+            max_tokens: 单次润色的最大输出token数，默认读取settings.REFINE_MAX_TOKENS
+        """
+        settings = processor.settings
+        self.processor = processor
+        self.doc_type = doc_type
+        self.context_tokens = context_tokens or settings.TEXT_CONTEXT_TOKENS
+        self.max_tokens = max_tokens or settings.REFINE_MAX_TOKENS
+        self.executor = ThreadPoolExecutor(max_workers or settings.REFINE_WORKERS)
+
+        prompt = processor.prompt_manager.get_prompt(doc_type, "refinement")
+        prompt_tokens = estimate_tokens(prompt) + estimate_tokens(MARKER_INSTRUCTION)
+        # 输出长度与输入相当，输入和输出共同占用上下文窗口
+        available = self.context_tokens - prompt_tokens
+        self.pack_tokens = max(1, min(available // 2, self.max_tokens))
+
+    async def run(self, extraction_tasks: List[asyncio.Future]) -> list:
+        """
+        按页码顺序等待抽取任务，凑满一个上下文窗口即提交润色
+
+        Args:
+            extraction_tasks: 按页码顺序排列的抽取任务
+
+        Returns:
+            list: 与输入顺序一致的润色结果；非文本结果原样返回
+        """
+        results = [None] * len(extraction_tasks)
+        model_markers = {}
+        refine_tasks = []
+        pack, pack_tokens = [], 0
+        skipped = False
+
+        def submit():
+            nonlocal pack, pack_tokens
+            if pack:
+                refine_tasks.append(asyncio.ensure_future(self._refine_pack(pack, results)))
+            pack, pack_tokens = [], 0
+
+        try:
+            for index, task in enumerate(extraction_tasks):
+                result = await task
+                results[index] = result
+                if not isinstance(result, str):
+                    # 非文本结果（如HTML页面字典）不参与润色，并打断跨页合并
+                    if result is not None and not skipped:
+                        print(f"第 {index + 1} 页不是文本结果，润色仅支持markdown类文档，已跳过")
+                        skipped = True
+                    submit()
+                    continue
+
+                match = MODEL_MARKER_PATTERN.match(result)
+                if match:
+                    model_markers[index] = match.group(0).rstrip("\n")
+                    results[index] = result = result[match.end():]
+
+                tokens = estimate_tokens(result)
+                if pack and pack_tokens + tokens > self.pack_tokens:
+                    submit()
+                pack.append(index)
+                pack_tokens += tokens
+            submit()
+
+            await asyncio.gather(*refine_tasks)
+        finally:
+            self.executor.shutdown(wait=False)
+        for index, marker in model_markers.items():
+            results[index] = f"{marker}\n{results[index]}"
+        return results
+
+    async def _refine_pack(self, indices: List[int], results: list):
+        """润色一组连续页面并按页标记拆回各页"""
+        text = "\n\n".join(
+            f"{PAGE_MARKER.format(i + 1)}\n{results[i]}" for i in indices
+        )
+        max_tokens = min(self.max_tokens, self.context_tokens - estimate_tokens(text))
+        loop = asyncio.get_event_loop()
+        try:
+            refined = await loop.run_in_executor(
+                self.executor,
+                self.processor.refine_text,
+                text,
+                self.doc_type,
+                max(1, max_tokens),
+                MARKER_INSTRUCTION
+            )
+        except Exception as e:
+            print(f"润色失败，保留原始内容（第{indices[0] + 1}-{indices[-1] + 1}页）: {e}")
+            return
+
+        if not isinstance(refined, str):
+            print(f"润色输出被截断，保留原始内容（第{indices[0] + 1}-{indices[-1] + 1}页）")
+            return
+        pages = self._split_pages(refined, indices)
+        if pages is None:
+            print(f"润色结果的页标记缺失或顺序不符，保留原始内容（第{indices[0] + 1}-{indices[-1] + 1}页）")
+            return
+        for index, content in pages.items():
+            results[index] = content
+
+    @staticmethod
+    def _split_pages(refined: str, indices: List[int]) -> Optional[dict]:
+        """
+        根据页标记拆分润色结果
+
+        只有包内每一页的标记都按顺序出现时才接受拆分；标记存在但内容为空的页面视为已合并到前一页。
+        单页的包没有标记时整段内容归入该页。
+
+        Returns:
+            dict: 页面索引 -> 润色后的内容；标记缺失、重复或乱序时返回None
+        """
+        parts = PAGE_MARKER_PATTERN.split(refined)
+        if len(parts) == 1:
+            return {indices[0]: refined.strip()} if len(indices) == 1 else None
+
+        # parts: [前导文本, 页码, 内容, 页码, 内容, ...]
+        page_numbers = [int(page_str) - 1 for page_str in parts[1::2]]
+        if page_numbers != list(indices):
+            return None
+        pages = {index: content.strip() for index, content in zip(page_numbers, parts[2::2])}
+        leading = parts[0].strip()
+        if leading:
+            pages[indices[0]] = (leading + "\n\n" + pages[indices[0]]).strip()
+        return pages
@@ -0,0 +1,202 @@
+# scheduler.py
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 没有历史数据时每页的默认输出token数
+DEFAULT_PAGE_TOKENS = 800
+# 没有历史数据时每个文本字符对应的输出token数
+DEFAULT_TOKENS_PER_CHAR = 0.5
+# 每张嵌入图片额外的输出token数（图像div、说明文字等）
+IMAGE_TOKENS = 60
+# 输入图像token（28x28像素一个）相对输出token的耗时权重，预填充远快于解码
+PIXEL_TOKEN_WEIGHT = 0.05
+# 没有历史耗时数据时的单请求有效输出速度（token/秒，含预填充和网络开销）
+DEFAULT_TOKENS_PER_SECOND = 25
+
+
+def _merge_stats(target: dict, delta: dict):
+    """将delta中各doc_type的计数累加到target"""
+    for doc_type, counts in delta.items():
+        stat = target.setdefault(doc_type, {})
+        for key, value in counts.items():
+            stat[key] = stat.get(key, 0) + value
+
+
+@contextmanager
+def _locked(lock_path: str):
+    """跨进程的排他文件锁；没有fcntl的平台（Windows）上只保证原子替换"""
+    with open(lock_path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PageCostEstimator:
+    """
+    页面处理成本估算器
+
+    根据文本字符数、像素数、图片数以及各doc_type的历史输出token统计估算每页的处理成本，
+    单位为等效输出token数。历史统计保存在JSON文件中，跨运行、跨进程累积。
+    """
+
+    def __init__(self, stats_path: Optional[str] = None):
+        self.stats_path = stats_path
+        self.lock = threading.Lock()
+        # doc_type -> {"pages", "completion_tokens", "chars", "text_tokens", "seconds", "timed_tokens"}
+        self.stats: Dict[str, dict] = (self._read_stats() or {}) if stats_path else {}
+        # 上次写回之后本进程新增的统计，save时合并到磁盘上的最新内容
+        self.pending: Dict[str, dict] = {}
+
+    def tokens_per_page(self, doc_type: str) -> float:
+        """历史平均每页输出token数"""
+        stat = self.stats.get(doc_type)
+        if not stat or not stat.get("pages"):
+            return DEFAULT_PAGE_TOKENS
+        return stat["completion_tokens"] / stat["pages"]
+
+    def tokens_per_char(self, doc_type: str) -> float:
+        """历史上有文本层页面的每字符输出token数"""
+        stat = self.stats.get(doc_type)
+        if not stat or not stat.get("chars"):
+            return DEFAULT_TOKENS_PER_CHAR
+        return stat["text_tokens"] / stat["chars"]
+
+    def tokens_per_second(self, doc_type: str) -> float:
+        """历史上单个请求的有效输出速度（token/秒）"""
+        stat = self.stats.get(doc_type)
+        if not stat or not stat.get("seconds"):
+            return DEFAULT_TOKENS_PER_SECOND
+        return stat["timed_tokens"] / stat["seconds"]
+
+    def estimate_completion_tokens(self, doc_type: str, signals: Optional[dict] = None,
+                                   file_size_ratio: float = 1.0) -> float:
+        """
+        估算单页的输出token数
+
+        Args:
+            doc_type: 文档类型
+            signals: PDFProcessor.page_signals中的页面信号，可为None
+            file_size_ratio: 没有文本层信号时，页面图片大小相对批次均值的比例
+
+        Returns:
+            float: 估算的输出token数
+        """
+        if signals and signals.get("char_count"):
+            tokens = signals["char_count"] * self.tokens_per_char(doc_type)
+        else:
+            # 扫描件等没有文本层的页面，以PNG压缩后的大小近似内容密度
+            tokens = self.tokens_per_page(doc_type) * file_size_ratio
+
+        if signals:
+            tokens += signals.get("image_count", 0) * IMAGE_TOKENS
+        return tokens
+
+    def estimate(self, doc_type: str, signals: Optional[dict] = None, file_size_ratio: float = 1.0) -> float:
+        """
+        估算单页成本
+
+        Args:
+            doc_type: 文档类型
+            signals: PDFProcessor.page_signals中的页面信号，可为None
+            file_size_ratio: 没有文本层信号时，页面图片大小相对批次均值的比例
+
+        Returns:
+            float: 估算的等效输出token数
+        """
+        tokens = self.estimate_completion_tokens(doc_type, signals, file_size_ratio)
+        if signals:
+            tokens += signals.get("pixels", 0) / (28 * 28) * PIXEL_TOKEN_WEIGHT
+        return tokens
+
+    def record(self, doc_type: str, completion_tokens: int, signals: Optional[dict] = None,
+               seconds: Optional[float] = None):
+        """记录一页的实际输出token数，以及可选的处理耗时（秒）"""
+        delta = {"pages": 1, "completion_tokens": completion_tokens}
+        if signals and signals.get("char_count"):
+            delta["chars"] = signals["char_count"]
+            delta["text_tokens"] = completion_tokens
+        if seconds:
+            delta["seconds"] = seconds
+            delta["timed_tokens"] = completion_tokens
+        with self.lock:
+            _merge_stats(self.stats, {doc_type: delta})
+            _merge_stats(self.pending, {doc_type: delta})
+
+    def save(self):
+        """
+        将本进程尚未写回的统计合并到JSON文件
+
+        多个进程（队列worker）共享同一文件：在文件锁内读取磁盘上的最新统计、
+        加上本进程的增量，写入临时文件后原子替换，读取方不会看到写了一半的文件。
+        """
+        if not self.stats_path:
+            return
+        with self.lock:
+            if not self.pending:
+                return
+            try:
+                with _locked(f"{self.stats_path}.lock"):
+                    stats = self._read_stats()
+                    if stats is None:
+                        # 磁盘上的文件无法读取时以内存中的统计为准（已包含本进程的增量）
+                        stats = self.stats
+                    else:
+                        _merge_stats(stats, self.pending)
+                    directory = os.path.dirname(os.path.abspath(self.stats_path))
+                    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                    try:
+                        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                            json.dump(stats, f, ensure_ascii=False, indent=2)
+                        os.replace(tmp_path, self.stats_path)
+                    except BaseException:
+                        os.unlink(tmp_path)
+                        raise
+                self.stats = stats
+                self.pending = {}
+            except OSError as e:
+                print(f"保存历史统计{self.stats_path}出错: {e}")
+
+    def _read_stats(self) -> Optional[dict]:
+        """读取磁盘上的统计；文件不存在时为空字典，无法解析时为None"""
+        if not os.path.exists(self.stats_path):
+            return {}
+        try:
+            with open(self.stats_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"加载历史统计{self.stats_path}出错: {e}")
+            return None
+
+    def schedule(self, image_paths: List[str], doc_type: str, page_signals: Optional[dict] = None) -> List[int]:
+        """
+        按估算成本从高到低排列页面（最长处理时间优先），缩短批次的尾部等待
+
+        Args:
+            image_paths: 页面图片路径列表
+            doc_type: 文档类型
+            page_signals: {图片路径: 页面信号}
+
+        Returns:
+            list: 页面下标的提交顺序
+        """
+        page_signals = page_signals or {}
+        sizes = [os.path.getsize(p) if os.path.exists(p) else 0 for p in image_paths]
+        mean_size = (sum(sizes) / len(sizes)) if sizes else 0
+        costs = [
+            self.estimate(doc_type, page_signals.get(path), size / mean_size if mean_size else 1.0)
+            for path, size in zip(image_paths, sizes)
+        ]
+        return sorted(range(len(image_paths)), key=lambda i: costs[i], reverse=True)
@@ -0,0 +1,126 @@
+# worker.py
+import os
+import socket
+import threading
+import uuid
+
+from src.core.llm_integration import LLMProcessor
+from src.utils.pdf_processor import PDFProcessor
+
+
+class QueueWorker:
+    """
+    从共享任务队列租用并执行任务的worker
+
+    每个worker进程启动settings.MAX_WORKERS个线程，各自租用任务；
+    处理期间后台线程定期续租，进程崩溃后租约过期，任务由其他worker重新租用。
+    """
+
+    def __init__(self, queue, settings, worker_id=None):
+        """
+        Args:
+            queue: SQLiteJobQueue实例
+            settings: 配置对象
+            worker_id: worker标识，默认由主机名、进程号和随机串组成
+        """
+        self.queue = queue
+        self.settings = settings
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.processor = LLMProcessor(settings)
+        self.stop_event = threading.Event()
+
+    def run(self, poll_interval=2.0, exit_when_idle=False):
+        """
+        启动处理线程并阻塞直到停止
+
+        Args:
+            poll_interval: 没有任务时的轮询间隔（秒）
+            exit_when_idle: 队列中没有待处理或处理中的任务时是否退出
+        """
+        threads = [
+            threading.Thread(target=self._loop, args=(f"{self.worker_id}/{i}", poll_interval, exit_when_idle))
+            for i in range(self.settings.MAX_WORKERS)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+
+    def _loop(self, worker_id, poll_interval, exit_when_idle):
+        while not self.stop_event.is_set():
+            task = self.queue.lease(worker_id)
+            if task is None:
+                # 其他线程正在拆分的文档随后会产生页面任务，只有整个队列都完成时才退出
+                if exit_when_idle and not self.queue.has_unfinished():
+                    return
+                self.stop_event.wait(poll_interval)
+                continue
+            self._execute(worker_id, task)
+
+    def _execute(self, worker_id, task):
+        """执行单个任务，期间定期续租"""
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(worker_id, task["task_id"], done), daemon=True)
+        heartbeat.start()
+        try:
+            if task["kind"] == "document":
+                pages = self._split_document(task["payload"])
+                self.queue.complete_document(task["task_id"], worker_id, task["doc_id"], pages)
+            else:
+                result = self._process_page(task["payload"])
+                self.queue.complete(task["task_id"], worker_id, result)
+        except Exception as e:
+            print(f"任务 {task['task_id']} 失败: {e}")
+            self.queue.fail(task["task_id"], worker_id, str(e))
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _heartbeat(self, worker_id, task_id, done):
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not done.wait(interval):
+            if not self.queue.heartbeat(task_id, worker_id):
+                return
+
+    def _split_document(self, payload):
+        """渲染PDF页面到共享目录，返回页面任务列表"""
+        options = payload["options"]
+        pdf_processor = PDFProcessor(
+            dpi=options.get("dpi", 150),
+            adaptive=options.get("adaptive_dpi", False),
+            min_dpi=options.get("min_dpi", 72),
+            max_dpi=options.get("max_dpi", 300),
+            max_pixels=self.settings.MAX_PAGE_PIXELS,
+            mask_repeated=options.get("mask_repeated", False)
+        )
+        images_dir = os.path.join(payload["output_dir"], "pdf_images")
+        image_paths = pdf_processor.pdf_to_images(payload["pdf_path"], images_dir)
+        return [
+            {
+                "page": index + 1,
+                "image_path": os.path.abspath(path),
+                "doc_type": options.get("doc_type", "default"),
+                "max_tokens": options.get("max_tokens", 4096),
+                "signals": pdf_processor.page_signals.get(path),
+            }
+            for index, path in enumerate(image_paths)
+        ]
+
+    def _process_page(self, payload):
+        """处理单页，结果与process_images_batch返回的元素一致；处理后写回该页的token和耗时统计"""
+        try:
+            return self.processor._process_and_record(
+                payload["image_path"],
+                payload["doc_type"],
+                payload["max_tokens"],
+                False,
+                'markdown',
+                payload.get("signals")
+            )
+        finally:
+            self.processor.cost_estimator.save()
@@ -1,5 +1,11 @@
 import os
+import json
 from typing import List
+
+from bs4 import NavigableString, Tag
+
+from src.utils.token_counter import estimate_tokens
+
 def save_as_markdown(content: str, file_name: str) -> None:
     """
     将给定的字符串内容保存为一个Markdown文件。
@@ -14,19 +20,21 @@ def save_as_markdown(content: str, file_name: str) -> None:
     except Exception as e:
         print(f"保存文件时发生错误: {e}")
 
-def save_as_jsonl(content: List, file_name: str) -> None:
+def save_as_jsonl(content: List[dict], file_name: str, append: bool = False) -> None:
     """
-    将给定的字符串内容保存为一个JSONL文件。
+    将给定的记录列表保存为一个JSONL文件（每行一个JSON对象）。
 
-    :param content: 要保存到JSONL文件的字符串内容。
+    :param content: 要保存的记录列表，每项为可JSON序列化的字典。
     :param file_name: 目标JSONL文件的文件名（包括路径）。
-    """ 
+    :param append: 是否追加写入已有文件，默认覆盖。
+    """
     try:
-        with open(file_name, 'w', encoding='utf-8') as file:
-            file.write(content)
+        with open(file_name, 'a' if append else 'w', encoding='utf-8') as file:
+            for record in content:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
         print(f"JSONL 文件已成功保存为 '{file_name}'")
     except Exception as e:
-        print(f"保存文件时发生错误: {e}")   
+        print(f"保存文件时发生错误: {e}")
 
 def save_as_json(content: List, file_name: str) -> None:
     """
@@ -40,4 +48,124 @@ def save_as_json(content: List, file_name: str) -> None:
             file.write(content)
         print(f"JSON 文件已成功保存为 '{file_name}'")
     except Exception as e:
-        print(f"保存文件时发生错误: {e}")   
\ No newline at end of file
+        print(f"保存文件时发生错误: {e}")
+
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+CONTAINER_TAGS = ('body', 'div', 'section', 'article', 'main', 'header', 'footer')
+# 作为整体保留、不再向下拆分的div类名
+ATOMIC_CLASSES = ('image', 'formula', 'chart', 'music sheet', 'chemical formula')
+
+
+def _merge_bbox(current, bbox):
+    """合并两个bbox为外接矩形"""
+    if bbox is None:
+        return current
+    if current is None:
+        return list(bbox)
+    return [min(current[0], bbox[0]), min(current[1], bbox[1]),
+            max(current[2], bbox[2]), max(current[3], bbox[3])]
+
+
+def _iter_blocks(root):
+    """按阅读顺序遍历块级元素，遇到纯容器div时向下展开"""
+    for child in root.children:
+        if isinstance(child, NavigableString):
+            if child.strip():
+                yield child
+            continue
+        if not isinstance(child, Tag):
+            continue
+        classes = ' '.join(child.get('class', []))
+        is_container = (
+            child.name in CONTAINER_TAGS
+            and classes not in ATOMIC_CLASSES
+            and any(isinstance(c, Tag) for c in child.children)
+        )
+        if is_container:
+            yield from _iter_blocks(child)
+        else:
+            yield child
+
+
+def build_page_chunks(root, page_num, bbox_map=None, image_refs=None, target_tokens=512) -> List[dict]:
+    """
+    将单页已解析的HTML树按标题和表格切分为RAG分块
+
+    Args:
+        root: BeautifulSoup对象或页面body标签
+        page_num: 当前页码
+        bbox_map: {id(tag): bbox} 清理属性前记录的源bbox
+        image_refs: {id(tag): {"id": ..., "path": ...}} 图像引用信息
+        target_tokens: 每个分块的目标token长度
+
+    Returns:
+        list: 分块字典列表，包含page、element_type、heading、text、images、bbox、tokens
+    """
+    bbox_map = bbox_map or {}
+    image_refs = image_refs or {}
+    chunks = []
+    heading = None
+    current = None
+
+    def new_chunk(element_type='text'):
+        return {
+            "page": page_num,
+            "element_type": element_type,
+            "heading": heading,
+            "text": "",
+            "images": [],
+            "bbox": None,
+            "tokens": 0,
+        }
+
+    def flush():
+        nonlocal current
+        if current and (current["text"].strip() or current["images"]):
+            current["text"] = current["text"].strip()
+            chunks.append(current)
+        current = None
+
+    for block in _iter_blocks(root):
+        if isinstance(block, NavigableString):
+            text, bbox, images = block.strip(), None, []
+        else:
+            text = block.get_text(" ", strip=True)
+            bbox = bbox_map.get(id(block))
+            images = [image_refs[id(block)]] if id(block) in image_refs else []
+            child_bbox = None
+            for tag in block.find_all(True):
+                if id(tag) in image_refs:
+                    images.append(image_refs[id(tag)])
+                child_bbox = _merge_bbox(child_bbox, bbox_map.get(id(tag)))
+            # 块本身没有bbox时使用子元素的外接矩形
+            bbox = bbox or child_bbox
+
+        tokens = estimate_tokens(text)
+        name = getattr(block, 'name', None)
+
+        if name in HEADING_TAGS:
+            flush()
+            heading = text
+            current = new_chunk()
+        elif name == 'table':
+            flush()
+            current = new_chunk('table')
+            current["text"], current["tokens"] = text, tokens
+            current["images"].extend(images)
+            current["bbox"] = _merge_bbox(None, bbox)
+            flush()
+            continue
+        elif current is not None and current["tokens"] + tokens > target_tokens and current["tokens"] > 0:
+            flush()
+
+        if current is None:
+            current = new_chunk()
+        if text:
+            current["text"] += text + "\n"
+        current["tokens"] += tokens
+        current["images"].extend(images)
+        current["bbox"] = _merge_bbox(current["bbox"], bbox)
+
+    flush()
+    return chunks
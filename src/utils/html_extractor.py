@@ -1,13 +1,122 @@
 from bs4 import BeautifulSoup, Tag
+import fitz  # PyMuPDF
 import re
 from PIL import Image
 import os
 import base64
 import io
+import hashlib
+import html
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.exporter import build_page_chunks
+from src.utils.profiler import profiler
 
 ImageInfo = namedtuple('ImageInfo', ['bbox', 'index', 'page'])
 
+HTML_DOCUMENT_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Combined Document</title>
+    <style>
+        body {
+            max-width: 1200px;
+            margin: 0 auto;
+            padding: 20px;
+        }
+        .page {
+            margin-bottom: 40px;
+        }
+        .page-break {
+            height: 1px;
+            background-color: #ddd;
+            margin: 30px 0;
+        }
+        img {
+            max-width: 100%;
+            height: auto;
+        }
+    </style>
+</head>
+<body>
+   """
+# 内嵌base64时重复图像的引用解析脚本，仅在文档中存在data-src-ref时输出；
+# 不执行脚本的阅读器回退到src中的共享图像文件路径
+FIGURE_REF_SCRIPT = """
+<script>
+    // 重复图像只内嵌一次，其余引用指向首次出现的图像
+    document.querySelectorAll('img[data-src-ref]').forEach(function (img) {
+        var source = document.querySelector('#' + img.dataset.srcRef + ' img');
+        if (source) { img.src = source.src; }
+    });
+</script>"""
+HTML_DOCUMENT_TAIL = """
+</body>
+</html>"""
+
+
+class FigureStore:
+    """
+    按内容哈希去重的图像存储
+
+    相同的截图只写一个文件（或只内嵌一次base64），后续引用指向首次出现的图像；
+    文件写入在后台线程池中执行。内嵌base64时重复图像的src为共享文件路径，
+    并通过data-src-ref由FIGURE_REF_SCRIPT在浏览器中替换为内嵌图像。
+    """
+
+    def __init__(self, output_dir="images", embed_base64=False, max_workers=4):
+        self.output_dir = output_dir
+        self.embed_base64 = embed_base64
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.futures = []
+        # 内容哈希 -> {"path": 首个文件路径, "ref": 首个图像div的id}
+        self.registry = {}
+        # 是否写出过data-src-ref引用，决定文档是否需要FIGURE_REF_SCRIPT
+        self.has_refs = False
+
+    @staticmethod
+    def content_hash(image):
+        """计算图像像素内容的哈希"""
+        digest = hashlib.sha1()
+        digest.update(f"{image.mode}:{image.size}".encode('utf-8'))
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def add(self, image, image_filename, ref):
+        """
+        登记一张截图，必要时提交后台写入
+
+        Args:
+            image: PIL.Image对象
+            image_filename: 首次出现时使用的文件名
+            ref: 当前图像div的id
+
+        Returns:
+            tuple: (entry, is_duplicate) entry包含path和ref
+        """
+        key = self.content_hash(image)
+        entry = self.registry.get(key)
+        if entry is not None:
+            return entry, True
+
+        image_path = os.path.join(self.output_dir, image_filename)
+        entry = {"path": image_path, "ref": ref}
+        self.registry[key] = entry
+        self.futures.append(self.executor.submit(image.save, image_path, format='PNG'))
+        return entry, False
+
+    def close(self):
+        """等待所有后台写入完成"""
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error saving image: {e}")
+        self.futures = []
+        self.executor.shutdown(wait=True)
+
 def crop_image(image_path, bbox, output_path=None, output_format='PNG'):
     """
     根据bbox从原图中截取图像并保存
@@ -40,6 +149,31 @@ def crop_image(image_path, bbox, output_path=None, output_format='PNG'):
         print(f"Error cropping image: {e}")
         return None
 
+def render_pdf_clip(page, bbox, image_size, dpi):
+    """
+    从源PDF页面中按bbox区域重新渲染图像
+    
+    Args:
+        page: fitz.Page对象
+        bbox: 页面图像坐标系下的边界框 [x1, y1, x2, y2]
+        image_size: 发送给LLM的页面图像尺寸 (width, height)
+        dpi: 区域渲染的DPI
+        
+    Returns:
+        PIL.Image对象；区域为空时返回None
+    """
+    rect = page.rect
+    scale_x = rect.width / image_size[0]
+    scale_y = rect.height / image_size[1]
+    clip = fitz.Rect(
+        rect.x0 + bbox[0] * scale_x, rect.y0 + bbox[1] * scale_y,
+        rect.x0 + bbox[2] * scale_x, rect.y0 + bbox[3] * scale_y
+    ) & rect
+    if clip.is_empty:
+        return None
+    pix = page.get_pixmap(dpi=dpi, clip=clip, alpha=False)
+    return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
 def image_to_base64(image, format='PNG'):
     """
     将图像转换为base64编码的字符串
@@ -64,7 +198,17 @@ def image_to_base64(image, format='PNG'):
     
     return f"data:image/{format.lower()};base64,{img_str}"
 
-def process_html_content(html_str, original_image_path, output_dir="images", embed_base64=False, start_index=1, page_num=None):
+def _parse_bbox(bbox_str):
+    """解析data-bbox属性为整数列表，格式不正确时返回None"""
+    try:
+        bbox = [int(float(x)) for x in bbox_str.split()]
+    except (AttributeError, ValueError):
+        return None
+    return bbox if len(bbox) == 4 else None
+
+@profiler.traced("post_process", "page_num")
+def process_html_content(html_str, original_image_path, output_dir="images", embed_base64=False, start_index=1, page_num=None,
+                         chunks=None, chunk_tokens=512, figure_store=None, source_page=None, figure_dpi=None):
     """
     处理单个HTML内容
     
@@ -75,6 +219,11 @@ def process_html_content(html_str, original_image_path, output_dir="images", emb
         embed_base64: 是否将图像转换为base64格式嵌入HTML
         start_index: 图像索引的起始值
         page_num: 当前处理的页码
+        chunks: 如果传入列表，则在同一次解析中将本页的RAG分块追加到该列表
+        chunk_tokens: 每个分块的目标token长度
+        figure_store: 跨页共享的FigureStore，用于图像去重；为None时仅在本页内去重
+        source_page: 源PDF中对应的fitz.Page，与figure_dpi同时指定时从PDF重新渲染图像区域
+        figure_dpi: 图像区域重新渲染的DPI
     
     Returns:
         tuple: (formatted_html, image_bboxes, image_paths, next_index)
@@ -84,28 +233,56 @@ def process_html_content(html_str, original_image_path, output_dir="images", emb
             - next_index: 下一页图像应该使用的起始索引
     """
     os.makedirs(output_dir, exist_ok=True)
+    owns_store = figure_store is None
+    if owns_store:
+        figure_store = FigureStore(output_dir, embed_base64)
+    
+    # 旋转页面的坐标映射较复杂，仍从页面图像截取
+    render_clips = bool(source_page is not None and figure_dpi and not source_page.rotation)
+    page_image_size = None
+    if render_clips:
+        with Image.open(original_image_path) as page_image:
+            page_image_size = page_image.size
     
     soup = BeautifulSoup(html_str, 'html.parser')
     image_bboxes = []
     image_paths = []
     image_index = start_index
     
+    # 在清理属性前记录源bbox，供分块使用
+    bbox_map = {}
+    image_refs = {}
+    if chunks is not None:
+        for tag in soup.find_all(attrs={'data-bbox': True}):
+            bbox = _parse_bbox(tag.get('data-bbox'))
+            if bbox:
+                bbox_map[id(tag)] = bbox
+    
     for div in soup.find_all('div', class_='image'):
         bbox_str = div.get('data-bbox')
         if bbox_str:
             bbox = [int(x) for x in bbox_str.split()]
             image_bboxes.append(ImageInfo(bbox=bbox, index=image_index, page=page_num))
             
-            # 设置图像文件名和路径
+            # 截取图像，相同内容只保存一次
             image_filename = f"image_{image_index}.png"
             image_path = os.path.join(output_dir, image_filename)
+            div['id'] = f'image_{image_index}'
+            cropped_img = None
+            if render_clips:
+                try:
+                    cropped_img = render_pdf_clip(source_page, bbox, page_image_size, figure_dpi)
+                except Exception as e:
+                    print(f"Error rendering clip: {e}")
+            if cropped_img is None:
+                cropped_img = crop_image(original_image_path, bbox)
+            is_duplicate = False
+            if cropped_img is not None:
+                entry, is_duplicate = figure_store.add(cropped_img, image_filename, div['id'])
+                image_path = entry["path"]
             image_paths.append(os.path.abspath(image_path))
             
-            # 截取并保存图像
-            cropped_img = crop_image(original_image_path, bbox, image_path)
-            
             # 更新div和img标签
-            div['id'] = f'image_{image_index}'
             if 'data-bbox' in div.attrs:
                 del div['data-bbox']
             
@@ -115,13 +292,20 @@ def process_html_content(html_str, original_image_path, output_dir="images", emb
             
             # 更新图片源
             if embed_base64 and cropped_img:
-                img_tag['src'] = image_to_base64(cropped_img)
+                if is_duplicate:
+                    # 不执行脚本时使用共享的图像文件
+                    img_tag['src'] = image_path
+                    img_tag['data-src-ref'] = entry["ref"]
+                    figure_store.has_refs = True
+                else:
+                    img_tag['src'] = image_to_base64(cropped_img)
             else:
-                img_tag['src'] = os.path.join(output_dir, image_filename)
+                img_tag['src'] = image_path
             
             if img_tag.parent is None:
                 div.append(img_tag)
             
+            image_refs[id(div)] = {"id": div['id'], "path": image_paths[-1]}
             image_index += 1
     
     # 清理和格式化HTML
@@ -162,20 +346,83 @@ def process_html_content(html_str, original_image_path, output_dir="images", emb
                 if 'format' in tag.attrs:
                     del tag['format']
     
+    if chunks is not None:
+        chunks.extend(build_page_chunks(
+            soup.body or soup, page_num,
+            bbox_map=bbox_map, image_refs=image_refs, target_tokens=chunk_tokens
+        ))
+    
+    if owns_store:
+        figure_store.close()
+    
     # 提取body内容
     body_content = soup.body.decode_contents() if soup.body else ""
     
     return body_content.strip(), image_bboxes, image_paths, image_index
 
 
-def combine_html_contents(page_contents, output_dir="images", embed_base64=False):
+def format_page_html(page_num, content, model=None):
+    """将单页内容包装为页面div，非首页前添加页面分隔符；model记录处理该页的模型"""
+    parts = []
+    if page_num > 1:
+        parts.append(f'<div class="page-break"></div>')
+    model_attr = f' data-model="{html.escape(model, quote=True)}"' if model else ''
+    parts.append(f'<div class="page" id="page-{page_num}"{model_attr}>')
+    parts.append(content)
+    parts.append('</div>')
+    return '\n'.join(parts)
+
+
+def _format_page_ranges(pages):
+    """将页码列表压缩为区间表示，如 [1, 2, 3, 5] -> "1-3,5" """
+    ranges = []
+    for page in sorted(pages):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def format_document_furniture(regions):
+    """
+    将跨页重复的页眉、页脚、水印格式化为文档级元数据块，每个区域只输出一次
+
+    Args:
+        regions: PDFProcessor.repeated_regions
+
+    Returns:
+        str: HTML片段，没有重复区域时为空字符串
+    """
+    if not regions:
+        return ""
+    parts = ['<div class="document-furniture">']
+    for region in regions:
+        text = html.escape(region["text"]).replace("\n", "<br>")
+        # 逐页变化的区域（如页码）输出数字替换为#的模式
+        variable = ' data-variable="true"' if region.get("variable") else ''
+        parts.append(
+            f'<p class="{region["role"]}" data-pages="{_format_page_ranges(region["pages"])}"{variable}>{text}</p>'
+        )
+    parts.append('</div>')
+    return '\n'.join(parts) + '\n'
+
+
+def combine_html_contents(page_contents, output_dir="images", embed_base64=False, chunks=None, chunk_tokens=512,
+                          source_pdf=None, figure_dpi=None, furniture=None):
     """
     处理多个HTML内容并合并成一个完整的文档
     
     Args:
         page_contents: 列表，每项包含页码和内容信息的字典
         output_dir: 图片保存目录
-        embed_base64: 是否将图像转换为base64格式嵌入HTML
+        embed_base64: 是否将图像转换为base64格式嵌入HTML；重复图像只内嵌一次，
+            其余引用依赖文档末尾的脚本，不执行脚本时回退到output_dir中的图像文件
+        chunks: 如果传入列表，则同时收集所有页面的RAG分块（带全局chunk_index）
+        chunk_tokens: 每个分块的目标token长度
+        source_pdf: 源PDF路径，与figure_dpi同时指定时从PDF以更高DPI重新渲染图像区域
+        figure_dpi: 图像区域重新渲染的DPI
+        furniture: 跨页重复区域（PDFProcessor.repeated_regions），作为文档元数据在正文前输出一次
     
     Returns:
         tuple: (complete_html, all_image_info)
@@ -188,6 +435,8 @@ def combine_html_contents(page_contents, output_dir="images", embed_base64=False
     all_contents = []
     all_image_info = []
     next_index = 1  # 起始图像索引
+    figure_store = FigureStore(output_dir, embed_base64)
+    source_doc = fitz.open(source_pdf) if source_pdf and figure_dpi else None
     
     # 处理每个页面的HTML内容
     for page_data in sorted_pages:
@@ -195,6 +444,9 @@ def combine_html_contents(page_contents, output_dir="images", embed_base64=False
         html_content = page_data["content"]["html_content"]
         image_path = page_data["content"]["original_image_path"]
         
+        model = page_data.get("model")
+        chunk_start = len(chunks) if chunks is not None else 0
+        
         # 处理当前页面的HTML，使用累积的索引
         content, bboxes, paths, next_index = process_html_content(
             html_content, 
@@ -202,51 +454,34 @@ def combine_html_contents(page_contents, output_dir="images", embed_base64=False
             output_dir=output_dir,
             embed_base64=embed_base64,
             start_index=next_index,
-            page_num=page_num
+            page_num=page_num,
+            chunks=chunks,
+            chunk_tokens=chunk_tokens,
+            figure_store=figure_store,
+            source_page=source_doc.load_page(page_num - 1) if source_doc and page_num <= len(source_doc) else None,
+            figure_dpi=figure_dpi
         )
         
-        # 添加页面分隔符
-        if page_num > 1:
-            all_contents.append(f'<div class="page-break"></div>')
-        
-        all_contents.append(f'<div class="page" id="page-{page_num}">')
-        all_contents.append(content)
-        all_contents.append('</div>')
+        all_contents.append(format_page_html(page_num, content, model))
+        if chunks is not None:
+            for chunk in chunks[chunk_start:]:
+                chunk["model"] = model
         
         # 收集图像信息
         for i, (bbox, path) in enumerate(zip(bboxes, paths)):
             all_image_info.append((bbox, path))
     
+    figure_store.close()
+    if source_doc:
+        source_doc.close()
+    
+    if chunks is not None:
+        for i, chunk in enumerate(chunks):
+            chunk["chunk_index"] = i
+    
     # 组合成完整的HTML文档
     _content = '\n'.join(all_contents)
-    complete_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Combined Document</title>
-    <style>
-        body {{
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-        }}
-        .page {{
-            margin-bottom: 40px;
-        }}
-        .page-break {{
-            height: 1px;
-            background-color: #ddd;
-            margin: 30px 0;
-        }}
-        img {{
-            max-width: 100%;
-            height: auto;
-        }}
-    </style>
-</head>
-<body>
-   {_content}
-</body>
-</html>"""
+    script = FIGURE_REF_SCRIPT if figure_store.has_refs else ""
+    complete_html = f"{HTML_DOCUMENT_HEAD}{format_document_furniture(furniture)}{_content}{script}{HTML_DOCUMENT_TAIL}"
     
-    return complete_html, all_image_info
\ No newline at end of file
+    return complete_html, all_image_info
@@ -1,22 +1,220 @@
 import fitz  # PyMuPDF
+import math
+import re
 from pathlib import Path
 import tempfile
 
+from src.utils.profiler import profiler
+
+# 自适应DPI：最小字号渲染后的目标像素高度
+MIN_GLYPH_PIXELS = 16
+# 自适应DPI：视为高密度文本页面的字符密度（字符/平方英寸）
+DENSE_CHARS_PER_SQIN = 100
+# 重复区域检测：出现在至少该比例页面上的同位置文本视为页眉/页脚/水印
+REPEAT_MIN_RATIO = 0.5
+# 重复区域检测：少于该页数的文档不做检测
+REPEAT_MIN_PAGES = 3
+# 重复区域检测：位置容差（占页面宽高的比例）
+REPEAT_POSITION_TOLERANCE = 0.02
+# 页眉/页脚所在的页面上下边缘带（占页面高度的比例）
+EDGE_BAND_RATIO = 0.15
+# 遮盖重复区域时向外扩展的边距（pt）
+MASK_PADDING = 2
+
+
+def _normalize_block_text(text):
+    """规范化文本块：合并空白，数字替换为#，使页码等逐页变化的内容可以匹配"""
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return re.sub(r'\d+', '#', text)
+
+
+def find_repeated_regions(doc, min_ratio=REPEAT_MIN_RATIO, min_pages=REPEAT_MIN_PAGES,
+                          tolerance=REPEAT_POSITION_TOLERANCE):
+    """
+    检测在多页相同位置重复出现的文本块（页眉、页脚、页码、水印）
+
+    Args:
+        doc: 已打开的fitz文档
+        min_ratio: 出现页数占总页数的最低比例
+        min_pages: 文档少于该页数时不检测
+        tolerance: 位置容差（占页面宽高的比例）
+
+    Returns:
+        list: 每项为dict，包含text（各页相同时为原文，逐页变化时为数字替换为#的模式，如"Page #"）、
+              variable（文本是否逐页变化）、role（header/footer/watermark）、
+              pages（出现的页码列表，从1开始）、rects（页码 -> 该页上的区域坐标）
+    """
+    page_count = len(doc)
+    if page_count < min_pages:
+        return []
+
+    # 规范化文本 -> 位置聚类列表，每个聚类记录参考位置和各页出现情况
+    clusters = {}
+    for page_num in range(page_count):
+        page = doc.load_page(page_num)
+        width, height = page.rect.width or 1, page.rect.height or 1
+        for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+            if block_type != 0:
+                continue
+            key = _normalize_block_text(text)
+            if not key:
+                continue
+            position = ((x0 + x1) / 2 / width, (y0 + y1) / 2 / height)
+            for cluster in clusters.setdefault(key, []):
+                ref = cluster["position"]
+                if abs(ref[0] - position[0]) <= tolerance and abs(ref[1] - position[1]) <= tolerance:
+                    break
+            else:
+                cluster = {"position": position, "text": text.strip(), "rects": {}, "variants": set()}
+                clusters[key].append(cluster)
+            cluster["variants"].add(text.strip())
+            cluster["rects"].setdefault(page_num + 1, []).append([x0, y0, x1, y1])
+
+    threshold = max(min_pages, math.ceil(page_count * min_ratio))
+    regions = []
+    for key_clusters in clusters.values():
+        for cluster in key_clusters:
+            if len(cluster["rects"]) < threshold:
+                continue
+            center_y = cluster["position"][1]
+            if center_y < EDGE_BAND_RATIO:
+                role = "header"
+            elif center_y > 1 - EDGE_BAND_RATIO:
+                role = "footer"
+            elif len(cluster["variants"]) == 1:
+                role = "watermark"
+            else:
+                # 仅数字不同的文本（页码）只在页面上下边缘带中认定
+                continue
+            variable = len(cluster["variants"]) > 1
+            regions.append({
+                "text": re.sub(r'\d+', '#', cluster["text"]) if variable else cluster["text"],
+                "variable": variable,
+                "role": role,
+                "pages": sorted(cluster["rects"]),
+                "rects": cluster["rects"],
+            })
+    regions.sort(key=lambda region: ({"header": 0, "watermark": 1, "footer": 2}[region["role"]], region["pages"][0]))
+    return regions
+
+
 class PDFProcessor:
-    def __init__(self, dpi=300):
+    def __init__(self, dpi=300, adaptive=False, min_dpi=72, max_dpi=300, max_pixels=None, mask_repeated=False):
+        """
+        Args:
+            dpi: 固定DPI；自适应模式下用于没有文本层的页面（如扫描件）
+            adaptive: 是否根据页面内容逐页选择DPI
+            min_dpi: 自适应DPI下限
+            max_dpi: 自适应DPI上限
+            max_pixels: 单页渲染像素上限，None表示不限制
+            mask_repeated: 是否在渲染前检测跨页重复的页眉/页脚/水印并从页面图片中遮盖
+        """
         self.dpi = dpi
-        
+        self.adaptive = adaptive
+        self.min_dpi = min_dpi
+        self.max_dpi = max_dpi
+        self.max_pixels = max_pixels
+        # 每页的廉价fitz信号，以图片路径为键，供调度和估算使用
+        self.page_signals = {}
+        self.mask_repeated = mask_repeated
+        # 文档级重复区域（页眉、页脚、水印），由prepare_document填充
+        self.repeated_regions = []
+
     def pdf_to_images(self, pdf_path, output_dir):
         """将PDF转换为有序的PNG图片"""
         Path(output_dir).mkdir(parents=True, exist_ok=True)
         doc = fitz.open(pdf_path)
+        self.prepare_document(doc)
         image_paths = []
-        
+
         for page_num in range(len(doc)):
+            image_paths.append(self.render_page(doc, page_num, output_dir))
+
+        return sorted(image_paths)
+
+    def prepare_document(self, doc):
+        """渲染前的文档级分析：启用mask_repeated时检测重复区域"""
+        self.repeated_regions = find_repeated_regions(doc) if self.mask_repeated else []
+        return self.repeated_regions
+
+    def render_page(self, doc, page_num, output_dir):
+        """将已打开文档中的单页渲染为PNG图片，返回图片路径"""
+        with profiler.span("render", page=page_num + 1):
             page = doc.load_page(page_num)
-            pix = page.get_pixmap(dpi=self.dpi)
+            signals = self.page_signals_of(page)
+            dpi = self.choose_dpi(page, signals)
+            pix = page.get_pixmap(dpi=dpi)
+            self._mask_regions(pix, page_num + 1, dpi)
             img_path = Path(output_dir) / f"page_{page_num+1:03d}.png"
             pix.save(img_path)
-            image_paths.append(str(img_path))
-            
-        return sorted(image_paths)
+        signals.update(dpi=dpi, pixels=pix.width * pix.height)
+        self.page_signals[str(img_path)] = signals
+        return str(img_path)
+
+    def _mask_regions(self, pix, page_number, dpi):
+        """将当前页上的重复区域涂白，避免模型逐页重复转写"""
+        scale = fitz.Matrix(dpi / 72, dpi / 72)
+        white = (255,) * pix.n
+        for region in self.repeated_regions:
+            for rect in region["rects"].get(page_number, []):
+                area = (fitz.Rect(rect) + (-MASK_PADDING, -MASK_PADDING, MASK_PADDING, MASK_PADDING)) * scale
+                area = area.irect & pix.irect
+                if not area.is_empty:
+                    pix.set_rect(area, white)
+
+    @staticmethod
+    def page_signals_of(page):
+        """
+        提取页面的廉价信号：最小字号、字符数、图片数和页面尺寸
+
+        Returns:
+            dict: min_font_size（无文本层时为None）、char_count、image_count、width、height（单位pt）
+        """
+        min_font_size = None
+        char_count = 0
+        for block in page.get_text("dict").get("blocks", []):
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    text = span.get("text", "").strip()
+                    if not text:
+                        continue
+                    char_count += len(text)
+                    size = span.get("size", 0)
+                    if size >= 1 and (min_font_size is None or size < min_font_size):
+                        min_font_size = size
+        return {
+            "min_font_size": min_font_size,
+            "char_count": char_count,
+            "image_count": len(page.get_images()),
+            "width": page.rect.width,
+            "height": page.rect.height,
+        }
+
+    def choose_dpi(self, page, signals=None):
+        """
+        为单页选择渲染DPI
+
+        非自适应模式直接返回固定DPI。自适应模式下取以下两者的较大值：
+        使最小字号渲染到MIN_GLYPH_PIXELS像素所需的DPI，以及随文本密度线性增长的DPI；
+        结果限制在[min_dpi, max_dpi]内，并受max_pixels约束。
+        """
+        if not self.adaptive:
+            return self.dpi
+        signals = signals or self.page_signals_of(page)
+        width, height = signals["width"], signals["height"]
+
+        if signals["min_font_size"] is None:
+            # 没有文本层，无法判断字号，使用固定DPI
+            dpi = self.dpi
+        else:
+            font_dpi = 72 * MIN_GLYPH_PIXELS / signals["min_font_size"]
+            area_sqin = max(width * height / (72 * 72), 1e-6)
+            density = min(signals["char_count"] / area_sqin / DENSE_CHARS_PER_SQIN, 1.0)
+            density_dpi = self.min_dpi + density * (self.max_dpi - self.min_dpi)
+            dpi = max(font_dpi, density_dpi)
+
+        dpi = min(max(dpi, self.min_dpi), self.max_dpi)
+        if self.max_pixels:
+            pixel_cap_dpi = 72 * math.sqrt(self.max_pixels / max(width * height, 1e-6))
+            dpi = min(dpi, pixel_cap_dpi)
+        return max(1, int(dpi))
@@ -0,0 +1,208 @@
+# profiler.py
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# 关闭时所有span共用的空上下文
+_NULL_SPAN = nullcontext()
+# Python 3.12起cProfile基于sys.monitoring，全局profile已覆盖所有线程，
+# 且同一时间只能启用一个profile，因此只在更早的版本中为工作线程单独启用
+_PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class _Span:
+    """记录一个时间线事件，并在工作线程中启用该线程的CPU profiler"""
+
+    __slots__ = ("profiler", "name", "args", "start", "thread_profile")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.thread_profile = None
+
+    def __enter__(self):
+        self.thread_profile = self.profiler._enter_thread()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self.profiler._exit_thread(self.thread_profile)
+        self.profiler._add_event(self.name, self.start, end, self.args)
+        return False
+
+
+class Profiler:
+    """
+    转换流程的内置性能分析器
+
+    启用后采集：各线程的CPU profile（合并为pstats格式）、阶段间的tracemalloc内存快照，
+    以及每页render/request/post_process等阶段的时间线（Chrome Trace Event格式，
+    可用chrome://tracing或Perfetto打开）。未启用时span()只返回共享的空上下文。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.output_dir = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._events = []
+        self._thread_profiles = []
+        self._snapshots = []
+        self._main_profile = None
+        self._main_thread = None
+        self._t0 = 0.0
+
+    def start(self, output_dir):
+        """开始采集，结果在stop()时写入output_dir"""
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self._events = []
+        self._thread_profiles = []
+        self._snapshots = []
+        self._local = threading.local()
+        self._t0 = time.perf_counter()
+        self._main_thread = threading.get_ident()
+        tracemalloc.start()
+        self._main_profile = cProfile.Profile()
+        self._main_profile.enable()
+        self.enabled = True
+
+    def span(self, name, **args):
+        """
+        标记一个阶段，用法: with profiler.span("request", page=3): ...
+
+        Args:
+            name: 阶段名称
+            **args: 附加到时间线事件上的参数
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def traced(self, name, *arg_names):
+        """
+        函数装饰器版本的span，arg_names中列出的关键字参数会记录到事件中
+
+        用法: @profiler.traced("post_process", "page_num")
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Span(self, name, {k: kwargs.get(k) for k in arg_names}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self, label):
+        """在阶段边界记录一次内存快照"""
+        if not self.enabled:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self._snapshots.append((label, tracemalloc.take_snapshot(), current, peak))
+
+    def stop(self):
+        """
+        停止采集并写出结果
+
+        Returns:
+            dict: 生成的文件路径（cpu、trace、memory）
+        """
+        if not self.enabled:
+            return {}
+        self.enabled = False
+        self._main_profile.disable()
+        current, peak = tracemalloc.get_traced_memory()
+        self._snapshots.append(("final", tracemalloc.take_snapshot(), current, peak))
+        tracemalloc.stop()
+
+        paths = {
+            "cpu": os.path.join(self.output_dir, "cpu.pstats"),
+            "trace": os.path.join(self.output_dir, "trace.json"),
+            "memory": os.path.join(self.output_dir, "memory.txt"),
+        }
+        stats = pstats.Stats(self._main_profile)
+        for profile in self._thread_profiles:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # 该线程没有采集到任何调用
+                continue
+        stats.dump_stats(paths["cpu"])
+
+        with open(paths["trace"], 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self._events, "displayTimeUnit": "ms"}, f)
+
+        self._write_memory_report(paths["memory"])
+        return paths
+
+    def _write_memory_report(self, path, top=15):
+        """写出每个快照的占用Top N，以及相邻快照之间的增长Top N"""
+        with open(path, 'w', encoding='utf-8') as f:
+            previous = None
+            for label, snap, current, peak in self._snapshots:
+                f.write(f"== {label}: current={current / 2**20:.1f} MiB, peak={peak / 2**20:.1f} MiB\n")
+                for stat in snap.statistics('lineno')[:top]:
+                    f.write(f"  {stat}\n")
+                if previous is not None:
+                    f.write(f"-- growth since {previous[0]}:\n")
+                    for stat in snap.compare_to(previous[1], 'lineno')[:top]:
+                        f.write(f"  {stat}\n")
+                f.write("\n")
+                previous = (label, snap)
+
+    def _enter_thread(self):
+        """工作线程中最外层span启用该线程的cProfile；主线程（3.12起为所有线程）已由全局profile覆盖"""
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        local.depth = depth + 1
+        if depth or threading.get_ident() == self._main_thread:
+            return None
+        if not getattr(local, "registered", False):
+            local.registered = True
+            with self._lock:
+                # 线程名元数据，便于在时间线中区分worker
+                self._events.append({
+                    "name": "thread_name", "ph": "M", "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"name": threading.current_thread().name},
+                })
+                if _PER_THREAD_PROFILES:
+                    local.profile = cProfile.Profile()
+                    self._thread_profiles.append(local.profile)
+        profile = getattr(local, "profile", None)
+        if profile is not None:
+            profile.enable()
+        return profile
+
+    def _exit_thread(self, profile):
+        self._local.depth -= 1
+        if profile is not None:
+            profile.disable()
+
+    def _add_event(self, name, start, end, args):
+        event = {
+            "name": name,
+            "cat": "doculingo",
+            "ph": "X",
+            "ts": (start - self._t0) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+
+profiler = Profiler()
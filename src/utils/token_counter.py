@@ -0,0 +1,24 @@
+import re
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]')
+_WORD_PATTERN = re.compile(r'[A-Za-z0-9]+|[^\sA-Za-z0-9]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量（无需加载tokenizer）
+
+    中日韩字符按每字1个token计算，其余按单词/符号计数并乘以1.3的系数。
+
+    Args:
+        text: 需要估算的文本
+
+    Returns:
+        int: 估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    rest = _CJK_PATTERN.sub(' ', text)
+    word_count = len(_WORD_PATTERN.findall(rest))
+    return cjk_count + int(word_count * 1.3 + 0.5)
@@ -0,0 +1,159 @@
+import sys
+import os
+import threading
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import openai
+import pytest
+from src.core.api_clients.circuit_breaker import CircuitBreaker
+from src.core.api_clients.failover_client import FailoverClient
+
+
+def in_thread(func, *args):
+    """在另一个线程中执行，模拟熔断前已发出的其他请求"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("value", func(*args)))
+    thread.start()
+    thread.join()
+    return result.get("value")
+
+
+def open_breaker(reset_seconds=0):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=reset_seconds)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_half_open_allows_single_probe():
+    breaker = open_breaker()
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+    assert not in_thread(breaker.allow_request)
+
+
+def test_probe_success_closes():
+    breaker = open_breaker()
+    assert breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens():
+    breaker = open_breaker(reset_seconds=60)
+    breaker.opened_at -= 60
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+
+
+def test_late_results_are_ignored():
+    breaker = open_breaker(reset_seconds=60)
+    # 熔断前发出的请求在OPEN状态下才返回
+    in_thread(breaker.record_success, 0.1)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.opened_at -= 60
+    assert breaker.allow_request()
+    in_thread(breaker.record_success, 0.1)
+    in_thread(breaker.record_failure)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_inconclusive_probe_releases_slot():
+    breaker = open_breaker()
+    assert breaker.allow_request()
+    breaker.record_inconclusive()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert in_thread(breaker.allow_request)
+
+
+def test_slow_success_counts_as_failure():
+    breaker = CircuitBreaker(failure_threshold=1, latency_threshold=1.0)
+    breaker.record_success(2.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+class FakeCompletions:
+    """按顺序返回或抛出预设结果，并记录请求参数"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        self.calls.append(params)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def status_error(cls, status_code):
+    response = SimpleNamespace(status_code=status_code, headers={}, request=None)
+    return cls(f"HTTP {status_code}", response=response, body=None)
+
+
+def make_client(primary_outcomes, threshold=1):
+    settings = SimpleNamespace(
+        OPENAI_API_KEY="test", API_BASE="http://primary", FALLBACK_API_KEY=None, FALLBACK_API_BASE=None,
+        VISION_MODEL="vision", TEXT_MODEL="text", FALLBACK_VISION_MODEL="vision-fallback", FALLBACK_TEXT_MODEL=None,
+        BREAKER_FAILURE_THRESHOLD=threshold, BREAKER_LATENCY_THRESHOLD=0, BREAKER_RESET_SECONDS=60,
+        REQUEST_TIMEOUT=120,
+    )
+    primary = FakeCompletions(primary_outcomes)
+    client = FailoverClient(settings, primary=primary)
+    client.fallback = FakeCompletions(["fallback"] * 5)
+    return client, primary
+
+
+@pytest.mark.parametrize("error", [
+    openai.APIConnectionError(request=None),
+    openai.APITimeoutError(request=None),
+    status_error(openai.InternalServerError, 500),
+    status_error(openai.RateLimitError, 429),
+])
+def test_outages_fail_over_and_open(error):
+    client, primary = make_client([error])
+    assert client.create(model="vision", messages=[]) == "fallback"
+    assert client.fallback.calls[0]["model"] == "vision-fallback"
+    assert client.breaker.state == CircuitBreaker.OPEN
+    # 熔断期间直接使用备用模型
+    assert client.create(model="text", messages=[]) == "fallback"
+    assert client.fallback.calls[1]["model"] == "vision-fallback"
+    assert len(primary.calls) == 1
+
+
+def test_request_errors_propagate_without_tripping():
+    client, _ = make_client([status_error(openai.BadRequestError, 400)])
+    with pytest.raises(openai.BadRequestError):
+        client.create(model="vision", messages=[])
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert not client.fallback.calls
+
+
+def test_caller_timeout_does_not_trip():
+    client, _ = make_client([openai.APITimeoutError(request=None)])
+    with pytest.raises(openai.APITimeoutError):
+        client.create(model="vision", messages=[], timeout=5)
+    assert client.breaker.state == CircuitBreaker.CLOSED
+    assert not client.fallback.calls
@@ -0,0 +1,42 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+from src.core.llm_integration import LLMProcessor
+
+stitch = LLMProcessor._stitch_continuation
+
+
+def test_stitch_removes_long_overlap():
+    partial = "<p>The quick brown fox jumps over"
+    addition = "brown fox jumps over the lazy dog</p>"
+    assert stitch(partial, addition) == "<p>The quick brown fox jumps over the lazy dog</p>"
+
+
+def test_stitch_keeps_short_coincidental_overlap():
+    assert stitch("<td>10", "0 apples</td>") == "<td>100 apples</td>"
+    assert stitch("The total is 1", "1 items") == "The total is 11 items"
+
+
+def test_stitch_removes_repeated_whole_line():
+    assert stitch("<tr>\n<td>a</td>\n", "<td>a</td>\n<td>b</td>") == "<tr>\n<td>a</td>\n<td>b</td>"
+
+
+def test_stitch_drops_reopened_code_fence():
+    assert stitch("```html\n<p>a", "```html\n</p>") == "```html\n<p>a</p>"
+
+
+def test_parse_code_block_complete():
+    parser = LLMProcessor._parse_code_block(None, "html")
+    assert parser("```html\n<p>a</p>\n```") == "<p>a</p>"
+
+
+def test_parse_code_block_missing_closing_fence():
+    parser = LLMProcessor._parse_code_block(None, "html")
+    assert parser("```html\n<p>a</p>\n<p>b") == "<p>a</p>\n<p>b"
+
+
+def test_parse_code_block_without_fence():
+    parser = LLMProcessor._parse_code_block(None, "markdown")
+    assert parser("  # Title\n") == "# Title"
@@ -0,0 +1,30 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+from src.core.hybrid import MIN_MATH_RATIO, _block_chars
+
+
+def block(*spans):
+    """构造只有一行的fitz文本块，spans为(文本, 字体)"""
+    return {"lines": [{"spans": [{"text": text, "font": font, "size": 10} for text, font in spans]}]}
+
+
+def math_ratio(b):
+    total, math_chars, _, _ = _block_chars(b)
+    return math_chars / total
+
+
+def test_greek_prose_is_not_math():
+    b = block(("Η γρήγορη καφέ αλεπού πηδάει πάνω από το τεμπέλικο σκυλί.", "Helvetica"))
+    assert math_ratio(b) < MIN_MATH_RATIO
+
+
+def test_greek_with_operators_is_math():
+    assert math_ratio(block(("α = β + γ", "Helvetica"))) >= MIN_MATH_RATIO
+    assert math_ratio(block(("∑ λ ≤ μ", "Helvetica"))) >= MIN_MATH_RATIO
+
+
+def test_math_font_is_math():
+    assert math_ratio(block(("xyz", "CMMI10"))) == 1
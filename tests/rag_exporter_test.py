@@ -0,0 +1,68 @@
+import sys
+import os
+import json
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+from src.utils.html_extractor import combine_html_contents
+from src.utils.exporter import save_as_jsonl
+
+page_contents = [{
+    "page": 1,
+    "content": {
+        "html_content": """<html><body>
+<h1 data-bbox="10 10 500 40">标题</h1>
+<p data-bbox="10 50 700 100">这是一段正文内容。</p>
+<table data-bbox="10 400 700 600"><tr><td>a</td><td>b</td></tr></table>
+</body></html>""",
+        "original_image_path": "assets/test_images/page_001.png"
+    }
+}, {
+    "page": 2,
+    "content": {
+        "html_content": """<html><body>
+<h2 data-bbox="20 30 400 60">第二节</h2>
+<p data-bbox="20 70 600 120">第二页正文。</p>
+</body></html>""",
+        "original_image_path": "assets/test_images/page_002.png"
+    }
+}]
+
+
+def build_chunks(output_dir):
+    chunks = []
+    combine_html_contents(
+        page_contents,
+        output_dir=str(output_dir),
+        chunks=chunks,
+        chunk_tokens=512
+    )
+    return chunks
+
+
+def test_chunks_split_on_heading_and_table(tmp_path):
+    chunks = build_chunks(tmp_path / "output_images")
+    assert [(c["page"], c["element_type"], c["heading"]) for c in chunks] == [
+        (1, "text", "标题"),
+        (1, "table", "标题"),
+        (2, "text", "第二节"),
+    ]
+    assert chunks[0]["text"] == "标题\n这是一段正文内容。"
+    assert chunks[1]["text"] == "a b"
+
+
+def test_chunk_bbox_and_index(tmp_path):
+    chunks = build_chunks(tmp_path / "output_images")
+    # 标题与正文合并为同一分块，bbox为两者的外接矩形
+    assert chunks[0]["bbox"] == [10, 10, 700, 100]
+    assert chunks[1]["bbox"] == [10, 400, 700, 600]
+    assert chunks[2]["bbox"] == [20, 30, 600, 120]
+    # chunk_index跨页全局递增
+    assert [c["chunk_index"] for c in chunks] == [0, 1, 2]
+
+
+def test_chunks_round_trip_jsonl(tmp_path):
+    chunks = build_chunks(tmp_path / "output_images")
+    path = tmp_path / "output.chunks.jsonl"
+    save_as_jsonl(chunks, str(path))
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == chunks
@@ -0,0 +1,33 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+from src.core.refinement import RefinementStage
+
+split = RefinementStage._split_pages
+
+
+def test_split_pages_in_order():
+    refined = "<!-- page: 3 -->\nA\n\n<!-- page: 4 -->\nB"
+    assert split(refined, [2, 3]) == {2: "A", 3: "B"}
+
+
+def test_split_pages_merged_page_keeps_marker():
+    refined = "<!-- page: 3 -->\nA B\n\n<!-- page: 4 -->\n"
+    assert split(refined, [2, 3]) == {2: "A B", 3: ""}
+
+
+def test_split_pages_missing_marker_is_rejected():
+    # 截断或模型漂移导致后续页标记缺失时不能清空这些页面
+    assert split("<!-- page: 3 -->\nA\n", [2, 3]) is None
+    assert split("A\n\nB", [2, 3]) is None
+
+
+def test_split_pages_out_of_order_is_rejected():
+    refined = "<!-- page: 4 -->\nB\n<!-- page: 3 -->\nA"
+    assert split(refined, [2, 3]) is None
+
+
+def test_split_pages_single_page_without_marker():
+    assert split("  refined text\n", [5]) == {5: "refined text"}